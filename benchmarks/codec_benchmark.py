@@ -0,0 +1,50 @@
+"""Compares dailybot.codec to dacite.from_dict / dataclasses.asdict on a large team's daily.
+
+    poetry run python benchmarks/codec_benchmark.py [users] [issues per user]
+"""
+import sys
+import timeit
+from dataclasses import asdict
+
+from dacite import from_dict
+
+from dailybot.codec import decode, encode
+from dailybot.mongodb import Daily, DailyReport, DailyIssueReport
+
+ROUNDS = 200
+
+
+def generate_daily(users: int, issues_per_user: int) -> Daily:
+    reports = {}
+    for user in range(users):
+        issue_reports = []
+        for issue in range(issues_per_user):
+            issue_report = DailyIssueReport(key=f"DAILY-{user * issues_per_user + issue}")
+            issue_report.status = "In Progress"
+            issue_report.details = "Worked on the review comments, waiting for QA"
+            issue_report.link = f"https://example.atlassian.net/browse/{issue_report.key}"
+            issue_report.summary = "Some issue summary of a reasonable length"
+            issue_reports.append(issue_report)
+        reports[f"U{user:08d}"] = DailyReport(issue_reports=issue_reports, general_comments="No blockers")
+    return Daily(team="benchmark", reports=reports)
+
+
+def report(name: str, baseline: float, current: float):
+    print(f"{name:<8} dacite/asdict {baseline / ROUNDS * 1000:8.3f}ms   codec {current / ROUNDS * 1000:8.3f}ms   "
+          f"x{baseline / current:.1f}")
+
+
+def main(users: int = 40, issues_per_user: int = 8):
+    daily = generate_daily(users, issues_per_user)
+    document = encode(daily)
+    assert document == asdict(daily) and decode(Daily, document) == from_dict(Daily, document)
+
+    print(f"Daily of {users} users with {issues_per_user} issues each, average of {ROUNDS} rounds")
+    report("decode", timeit.timeit(lambda: from_dict(Daily, document), number=ROUNDS),
+           timeit.timeit(lambda: decode(Daily, document), number=ROUNDS))
+    report("encode", timeit.timeit(lambda: asdict(daily), number=ROUNDS),
+           timeit.timeit(lambda: encode(daily), number=ROUNDS))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,273 @@
+import logging
+import os
+import time
+from datetime import date
+from threading import Thread, Event
+from typing import List, Optional
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from dailybot.metrics import record_timing
+from dailybot.mongodb import get_collection, DAILIES_COLLECTION_NAME, ANALYTICS_COLLECTION_NAME
+
+ANALYTICS_CLOSE_INTERVAL = "ANALYTICS_CLOSE_INTERVAL"
+DEFAULT_ANALYTICS_CLOSE_INTERVAL = 10 * 60
+# streaks count the reports of an issue, not calendar days: days the user did not report in neither break
+# nor extend a streak, so an issue in the same status before and after a vacation stays stuck
+DEFAULT_STUCK_DAYS = 3
+CLOSE_DAY_TIMEOUT = 60 * 60
+
+# kinds of the documents in the analytics collection
+STREAK = "streak"  # consecutive reports of an issue by a user in the same status, skipped days don't break it
+SUBMISSIONS = "submissions"  # number of dailies a user reported in
+TEAM_DAYS = "team_days"  # number of dailies a team reported in
+CLOSED_DAY = "closed_day"  # a date whose dailies were added to the other kinds
+
+RUNNING = "running"
+DONE = "done"
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_analytics_indexes():
+    analytics_collection = get_collection(ANALYTICS_COLLECTION_NAME)
+    analytics_collection.create_index([("kind", ASCENDING), ("team", ASCENDING), ("user_id", ASCENDING),
+                                       ("key", ASCENDING), ("last_date", DESCENDING)])
+    analytics_collection.create_index([("kind", ASCENDING), ("date", DESCENDING)])
+
+
+def _summary_id(kind: str, *parts) -> dict:
+    return {"$concat": [kind, *(part for value in parts for part in ("|", value))]}
+
+
+def _issue_rows_stages(daily_date: str) -> List[dict]:
+    """Flattens the day's dailies to one document per reported issue"""
+    return [
+        {"$match": {"date": daily_date}},
+        {"$project": {"team": 1, "reports": {"$objectToArray": "$reports"}}},
+        {"$unwind": "$reports"},
+        {"$unwind": "$reports.v.issue_reports"},
+        {"$project": {
+            "_id": 0,
+            "team": 1,
+            "user_id": "$reports.k",
+            "key": "$reports.v.issue_reports.key",
+            "status": "$reports.v.issue_reports.status"
+        }},
+    ]
+
+
+def close_streaks(daily_date: str):
+    """Continues the streak of every issue reported in the same status as its previous report, or starts a new one.
+    Issues whose streak already reached daily_date are skipped, so the day can be closed again after a failure"""
+    get_collection(DAILIES_COLLECTION_NAME).aggregate([
+        *_issue_rows_stages(daily_date),
+        {"$lookup": {
+            "from": ANALYTICS_COLLECTION_NAME,
+            "let": {"team": "$team", "user_id": "$user_id", "key": "$key"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$kind", STREAK]},
+                    {"$eq": ["$team", "$$team"]},
+                    {"$eq": ["$user_id", "$$user_id"]},
+                    {"$eq": ["$key", "$$key"]},
+                    {"$lte": ["$last_date", daily_date]}
+                ]}}},
+                {"$sort": {"last_date": -1}},
+                {"$limit": 1}
+            ],
+            "as": "previous"
+        }},
+        {"$set": {"previous": {"$arrayElemAt": ["$previous", 0]}}},
+        {"$match": {"previous.last_date": {"$ne": daily_date}}},
+        {"$set": {"continues": {"$eq": ["$previous.status", "$status"]}}},
+        {"$project": {
+            "_id": {"$cond": ["$continues", "$previous._id",
+                              _summary_id(STREAK, "$team", "$user_id", "$key", daily_date)]},
+            "kind": {"$literal": STREAK},
+            "team": 1,
+            "user_id": 1,
+            "key": 1,
+            "status": 1,
+            "start_date": {"$cond": ["$continues", "$previous.start_date", daily_date]},
+            "last_date": {"$literal": daily_date},
+            "days": {"$cond": ["$continues", {"$add": ["$previous.days", 1]}, 1]}
+        }},
+        {"$merge": {"into": ANALYTICS_COLLECTION_NAME, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+
+
+def _count_into_summary(stages: List[dict]):
+    # days are closed in order, so a count whose last_date is not before the new one already includes its day
+    get_collection(DAILIES_COLLECTION_NAME).aggregate([
+        *stages,
+        {"$merge": {
+            "into": ANALYTICS_COLLECTION_NAME,
+            "whenMatched": [{"$set": {
+                "count": {"$cond": [{"$lt": ["$last_date", "$$new.last_date"]},
+                                    {"$add": ["$count", "$$new.count"]},
+                                    "$count"]},
+                "last_date": {"$max": ["$last_date", "$$new.last_date"]}
+            }}],
+            "whenNotMatched": "insert"
+        }}
+    ])
+
+
+def close_submissions(daily_date: str):
+    _count_into_summary([
+        {"$match": {"date": daily_date}},
+        {"$project": {"team": 1, "user_id": {"$map": {"input": {"$objectToArray": "$reports"}, "in": "$$this.k"}}}},
+        {"$unwind": "$user_id"},
+        {"$project": {
+            "_id": _summary_id(SUBMISSIONS, "$team", "$user_id"),
+            "kind": {"$literal": SUBMISSIONS},
+            "team": 1,
+            "user_id": 1,
+            "count": {"$literal": 1},
+            "last_date": {"$literal": daily_date}
+        }},
+    ])
+    _count_into_summary([
+        {"$match": {"date": daily_date, "reports": {"$ne": {}}}},
+        {"$project": {
+            "_id": _summary_id(TEAM_DAYS, "$team"),
+            "kind": {"$literal": TEAM_DAYS},
+            "team": 1,
+            "count": {"$literal": 1},
+            "last_date": {"$literal": daily_date}
+        }},
+    ])
+
+
+def close_day(daily_date: str) -> bool:
+    """Adds a finished day's dailies to the analytics collection, at most once per day"""
+    analytics_collection = get_collection(ANALYTICS_COLLECTION_NAME)
+    day_id = f"{CLOSED_DAY}|{daily_date}"
+    # a day left running by a process that died is closed again
+    analytics_collection.delete_one(
+        {"_id": day_id, "status": RUNNING, "started_at": {"$lt": time.time() - CLOSE_DAY_TIMEOUT}}
+    )
+    try:
+        analytics_collection.insert_one({
+            "_id": day_id, "kind": CLOSED_DAY, "date": daily_date, "status": RUNNING, "started_at": time.time()
+        })
+    except DuplicateKeyError:
+        return False  # another process closes or closed it
+
+    started = time.perf_counter()
+    try:
+        close_streaks(daily_date)
+        close_submissions(daily_date)
+    except Exception:
+        # every stage skips what it already wrote, so the next attempt completes the day without counting twice
+        analytics_collection.delete_one({"_id": day_id})
+        raise
+    analytics_collection.update_one({"_id": day_id}, {"$set": {"status": DONE}})
+    record_timing("analytics.close_day", time.perf_counter() - started)
+    return True
+
+
+def get_last_closed_date() -> Optional[str]:
+    closed_day = get_collection(ANALYTICS_COLLECTION_NAME).find_one(
+        {"kind": CLOSED_DAY, "status": DONE}, sort=[("date", DESCENDING)]
+    )
+    return closed_day["date"] if closed_day else None
+
+
+def close_finished_days(today: Optional[str] = None) -> List[str]:
+    """Closes the days before today that have dailies, in order, since streaks continue from the previous day"""
+    today = today or str(date.today())
+    dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
+    dates = sorted(dailies_collection.distinct("date", {"date": {"$gt": get_last_closed_date() or "", "$lt": today}}))
+    closed = []
+    for daily_date in dates:
+        if not close_day(daily_date):
+            break
+        closed.append(daily_date)
+    return closed
+
+
+def get_team_last_closed_date(team: str) -> Optional[str]:
+    """The last closed date the team reported in, later closed days may have no dailies of the team"""
+    team_days = get_collection(ANALYTICS_COLLECTION_NAME).find_one({"_id": f"{TEAM_DAYS}|{team}"})
+    return team_days["last_date"] if team_days else None
+
+
+def get_stuck_issues(team: str, min_days: int = DEFAULT_STUCK_DAYS, user_id: Optional[str] = None) -> List[dict]:
+    """Issues whose report in the team's last closed daily was in the same status as their previous min_days - 1
+    reports"""
+    last_closed_date = get_team_last_closed_date(team)
+    if not last_closed_date:
+        return []
+    query = {"kind": STREAK, "team": team, "last_date": last_closed_date, "days": {"$gte": min_days}}
+    if user_id:
+        query["user_id"] = user_id
+    return list(get_collection(ANALYTICS_COLLECTION_NAME).find(query, sort=[("days", DESCENDING)]))
+
+
+def get_status_dwell_times(team: str, user_id: Optional[str] = None) -> List[dict]:
+    """Average and longest number of consecutive days issues were reported in each status"""
+    match = {"kind": STREAK, "team": team, **({"user_id": user_id} if user_id else {})}
+    return list(get_collection(ANALYTICS_COLLECTION_NAME).aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": "$status",
+            "average_days": {"$avg": "$days"},
+            "max_days": {"$max": "$days"},
+            "streaks": {"$sum": 1}
+        }},
+        {"$sort": {"average_days": -1}}
+    ]))
+
+
+def get_submission_rates(team: str, user_id: Optional[str] = None) -> List[dict]:
+    """Share of the team's dailies each user reported in"""
+    match = {"kind": SUBMISSIONS, "team": team, **({"user_id": user_id} if user_id else {})}
+    return list(get_collection(ANALYTICS_COLLECTION_NAME).aggregate([
+        {"$match": match},
+        {"$lookup": {
+            "from": ANALYTICS_COLLECTION_NAME,
+            "pipeline": [{"$match": {"_id": f"{TEAM_DAYS}|{team}"}}],
+            "as": "team_days"
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": 1,
+            "submitted": "$count",
+            "days": {"$arrayElemAt": ["$team_days.count", 0]},
+        }},
+        {"$set": {"rate": {"$divide": ["$submitted", "$days"]}}},
+        {"$sort": {"rate": -1}}
+    ]))
+
+
+class AnalyticsWorker(Thread):
+    def __init__(self, interval: Optional[float] = None):
+        super().__init__(name="analytics-worker", daemon=True)
+        self.interval = interval or float(os.environ.get(ANALYTICS_CLOSE_INTERVAL, DEFAULT_ANALYTICS_CLOSE_INTERVAL))
+        self._stop_event = Event()
+
+    def run(self):
+        try:
+            ensure_analytics_indexes()
+        except Exception as e:
+            logger.error(f"Error creating analytics indexes: {e}")
+        while not self._stop_event.is_set():
+            try:
+                closed = close_finished_days()
+                if closed:
+                    logger.info(f"Closed analytics of {', '.join(closed)}")
+            except Exception as e:
+                logger.error(f"Error closing analytics days: {e}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_analytics_worker(interval: Optional[float] = None) -> AnalyticsWorker:
+    worker = AnalyticsWorker(interval)
+    worker.start()
+    return worker
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, List, Tuple
+
+import aiohttp
+from jira import JIRA, Project, JIRAError
+
+from dailybot.constants import JiraHostType
+from dailybot.jira_pool import JiraPoolConfig, RETRY_STATUS_CODES
+from dailybot.jira_utils import projects_cache
+from dailybot.mongodb import User
+
+
+class AsyncJiraClient:
+    def __init__(self, server_url: str, session: aiohttp.ClientSession, config: JiraPoolConfig):
+        self.server_url = server_url.rstrip('/')
+        self.session = session
+        self.config = config
+        self.options = {**JIRA.DEFAULT_OPTIONS, "server": self.server_url}
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        url = f"{self.server_url}/rest/api/2/{path}"
+        for attempt in range(self.config.max_retries + 1):
+            async with self.session.request(method, url, **kwargs) as response:
+                if response.status in RETRY_STATUS_CODES and attempt < self.config.max_retries:
+                    retry_after = response.headers.get("Retry-After")
+                    delay = float(retry_after) if retry_after and retry_after.isdigit() \
+                        else self.config.backoff_factor * 2 ** attempt
+                    await asyncio.sleep(delay)
+                    continue
+                if response.status >= 400:
+                    raise JIRAError(status_code=response.status, text=await response.text(), url=url)
+                if response.status == 204:
+                    return None
+                return await response.json()
+
+    async def projects(self) -> List[dict]:
+        return await self._request("GET", "project")
+
+    def project_from_raw(self, raw: dict) -> Project:
+        return Project(self.options, None, raw=raw)
+
+
+# least recently used first, bounded like the sync client pool
+_sessions: "OrderedDict[Tuple[str, str, str, str], Tuple[float, aiohttp.ClientSession]]" = OrderedDict()
+_config = JiraPoolConfig()
+
+
+def _evict_idle_sessions(now: float):
+    while _sessions:
+        key, (last_used, session) = next(iter(_sessions.items()))
+        if len(_sessions) <= _config.max_clients and now - last_used < _config.idle_timeout:
+            break
+        _sessions.pop(key)
+        asyncio.ensure_future(session.close())
+
+
+def get_async_jira(user: User) -> AsyncJiraClient:
+    key = (user.jira_server_url, user.jira_email, user.jira_api_token, user.jira_host_type)
+    now = time.monotonic()
+    entry = _sessions.pop(key, None)
+    _evict_idle_sessions(now)
+    session = entry[1] if entry else None
+    if session is None or session.closed:
+        if user.jira_host_type == JiraHostType.Local.name:
+            auth, headers = None, {"Authorization": f"Bearer {user.jira_api_token}"}
+        elif user.jira_host_type == JiraHostType.Cloud.name:
+            auth, headers = aiohttp.BasicAuth(user.jira_email, user.jira_api_token), None
+        else:
+            raise Exception  # todo: handle
+        session = aiohttp.ClientSession(
+            auth=auth,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=_config.request_timeout),
+            connector=aiohttp.TCPConnector(limit_per_host=_config.connections_per_host)
+        )
+    _sessions[key] = (now, session)
+    return AsyncJiraClient(user.jira_server_url, session, _config)
+
+
+async def close_async_jira_sessions(*_):
+    """Closes every session, also usable as an aiohttp on_cleanup callback"""
+    sessions = [session for _, session in _sessions.values()]
+    _sessions.clear()
+    await asyncio.gather(*(session.close() for session in sessions))
+
+
+async def async_get_jira_projects(user: User) -> List[Project]:
+    key = user.jira_server_url.rstrip('/')
+    projects = projects_cache.get(key)
+    if projects is None:
+        jira_client = get_async_jira(user)
+        try:
+            projects = sorted((jira_client.project_from_raw(raw) for raw in await jira_client.projects()),
+                              key=lambda project: project.key)
+        except JIRAError:
+            return []
+        projects_cache.set(key, projects)
+    return projects
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from slack_bolt.async_app import AsyncApp
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from dailybot.analytics import start_analytics_worker, get_stuck_issues, get_status_dwell_times, get_submission_rates
+from dailybot.async_jira_utils import async_get_jira_projects, close_async_jira_sessions
+from dailybot.async_mongodb import (get_user, save_user, update_user_jira_keys, get_daily, save_daily_report,
+                                    save_team, enqueue_job, get_daily_draft, save_daily_draft, delete_daily_draft)
+from dailybot.block_utils import (generate_home_tab_view, generate_user_from_config_action,
+                                  generate_home_tab_view_set_jira_keys, generate_home_tab_view_user_configured,
+                                  generate_user_not_exists_modal,
+                                  generate_jira_projects_options, generate_loading_modal, generate_daily_error_modal,
+                                  parse_daily_view_state, get_empty_daily_errors, generate_team_analytics_message)
+from dailybot.constants import (DAILY_MODAL_SUBMISSION, ISSUE_LINK_ACTION, ISSUE_SUMMERY_ACTION,
+                                GENERAL_COMMENTS_ACTION, SAVE_USER_CONFIGURATIONS, SELECT_USER_BOARD, SELECT_USER_TEAM,
+                                DAILY_MODAL, SHOW_DAILY, ADD_TEAM,
+                                IGNORE_ISSUE_IN_DAILY_FORM, SELECT_STATUS_ISSUE_DAILY_FORM,
+                                DAILY_MODAL_FIRST_VIEW_METRIC, DAILY_MODAL_FULL_VIEW_METRIC,
+                                DAILY_MODAL_NEXT_PAGE, DAILY_MODAL_PREVIOUS_PAGE, SHOW_ANALYTICS)
+from dailybot.daily_jobs import DAILY_SUBMISSION_JOB, get_daily_submission_payload, start_daily_job_workers
+from dailybot.daily_publisher import start_daily_publisher, post_daily
+from dailybot.handler_utils import (render_daily_modal, is_paginated, get_submitted_report, get_selected_jira_keys,
+                                    get_home_tab_to_publish, parse_add_team_command, get_added_team_message,
+                                    parse_analytics_command)
+from dailybot.issue_sync import start_issue_sync_worker
+from dailybot.jira_utils import filter_projects
+from dailybot.jira_webhook import start_jira_webhook_server
+from dailybot.metrics import record_timing
+from dailybot.mongodb import Team, User, Daily, DailyDraft, ensure_daily_indexes
+from dailybot.slack_dispatcher import SlackDispatcher, INTERACTIVE, BULK
+from dailybot.user_cache import start_user_cache_invalidator
+
+app = AsyncApp(
+    token=os.environ.get("SLACK_BOT_TOKEN"),
+    signing_secret=os.environ.get("SLACK_SIGNING_SECRET")
+)
+# the handlers answer with the app's async client, posting dailies and the workers share the rate limited dispatcher
+slack_dispatcher = SlackDispatcher(WebClient(token=os.environ.get("SLACK_BOT_TOKEN")))
+interactive_client = slack_dispatcher.with_priority(INTERACTIVE)
+
+
+async def run_blocking(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, lambda: func(*args, **kwargs))
+
+
+async def async_render_daily_modal(user: User, daily: Daily, draft: Optional[DailyDraft], page: int = 0) -> dict:
+    # reading (or syncing when stale) the issue snapshot and the workflow statuses of the issues block
+    return await run_blocking(render_daily_modal, user, daily, draft, page=page)
+
+
+@app.shortcut(DAILY_MODAL)
+async def daily_report(ack, body, client, logger):
+    started = time.perf_counter()
+    await ack()
+    loading_view = (await client.views_open(trigger_id=body["trigger_id"], view=generate_loading_modal()))["view"]
+    record_timing(DAILY_MODAL_FIRST_VIEW_METRIC, time.perf_counter() - started)
+
+    user_id = body['user']['id']
+    try:
+        user = await get_user(user_id)
+        if user:
+            daily = await get_daily(user.team)
+            draft = await get_daily_draft(user_id)
+            view = await async_render_daily_modal(user, daily, draft)
+        else:
+            view = generate_user_not_exists_modal()
+    except Exception as e:
+        # otherwise the user is left with the loading modal
+        logger.error(f"Error building daily modal of {user_id}: {e}")
+        view = generate_daily_error_modal()
+
+    try:
+        await client.views_update(view_id=loading_view["id"], hash=loading_view["hash"], view=view)
+    except SlackApiError as e:
+        logger.error(f"Error updating daily modal: {e}")
+        return
+    record_timing(DAILY_MODAL_FULL_VIEW_METRIC, time.perf_counter() - started)
+
+
+async def change_daily_modal_page(ack, body, client, logger):
+    await ack()
+    view = body['view']
+    user = await get_user(body['user']['id'])
+    if not user:
+        logger.error(f"Daily modal page change of unknown user {body['user']['id']}")
+        return
+    draft = await get_daily_draft(user.slack_data.user_id)
+    draft.update_page(*parse_daily_view_state(view))
+    await save_daily_draft(draft)
+
+    new_view = await async_render_daily_modal(user, await get_daily(user.team), draft,
+                                              page=int(body['actions'][0]['value']))
+    try:
+        await client.views_update(view_id=view['id'], hash=view['hash'], view=new_view)
+    except SlackApiError as e:
+        logger.error(f"Error changing daily modal page: {e}")
+
+
+for action_id in (DAILY_MODAL_NEXT_PAGE, DAILY_MODAL_PREVIOUS_PAGE):
+    app.action(action_id)(change_daily_modal_page)
+
+
+async def ack_only_action(ack):
+    await ack()
+
+
+for action_id in (IGNORE_ISSUE_IN_DAILY_FORM, SELECT_STATUS_ISSUE_DAILY_FORM, ISSUE_LINK_ACTION, ISSUE_SUMMERY_ACTION,
+                  GENERAL_COMMENTS_ACTION, SELECT_USER_TEAM):
+    app.action(action_id)(ack_only_action)
+
+
+@app.view(DAILY_MODAL_SUBMISSION)
+async def handle_daily_submission(ack, body, view):
+    user = await get_user(body['user']['id'])
+    draft = await get_daily_draft(user.slack_data.user_id) if is_paginated(view) else None
+    report = await run_blocking(get_submitted_report, user, view, draft)
+    if not report:
+        await ack(response_action="errors", errors=get_empty_daily_errors(view))
+        return
+    daily = Daily(team=user.team)
+    await save_daily_report(daily, user.slack_data.user_id, report)
+    if draft:
+        await delete_daily_draft(draft)
+    # Jira enrichment and transitions run on the job workers
+    await enqueue_job(DAILY_SUBMISSION_JOB, get_daily_submission_payload(user, daily))
+    await ack()
+
+
+@app.event("app_home_opened")
+async def update_home_tab(client, event, logger):
+    user = await get_user(event['user'])
+
+    if not user:
+        view = generate_home_tab_view(teams=await run_blocking(Team.get_all_teams_cached))
+    elif not user.jira_keys:
+        view = generate_home_tab_view_set_jira_keys(user, projects=await async_get_jira_projects(user))
+    else:
+        view = generate_home_tab_view_user_configured()
+
+    view = get_home_tab_to_publish(view, published_view=event.get('view'))
+    if not view:
+        return
+    try:
+        await client.views_publish(user_id=event['user'], view=view)
+    except SlackApiError as e:
+        logger.error(f"Error publishing home tab: {e}")
+
+
+@app.action(SAVE_USER_CONFIGURATIONS)
+async def save_user_config_action(ack, body, client):
+    await ack()
+    user = await save_user(generate_user_from_config_action(body))
+    await client.views_publish(
+        user_id=user.slack_data.user_id,
+        view=generate_home_tab_view_set_jira_keys(user, projects=await async_get_jira_projects(user))
+    )
+
+
+@app.action(SELECT_USER_BOARD)
+async def select_user_board_action(ack, body, client):
+    await ack()
+    user = await get_user(body['user']['id'])
+    await update_user_jira_keys(user, get_selected_jira_keys(body))
+    await client.views_publish(user_id=user.slack_data.user_id, view=generate_home_tab_view_user_configured())
+
+
+@app.options(SELECT_USER_BOARD)
+async def search_user_board_options(ack, body):
+    user = await get_user(body['user']['id'])
+    projects = filter_projects(await async_get_jira_projects(user), body.get('value', '')) if user else []
+    await ack(generate_jira_projects_options(projects))
+
+
+@app.command(SHOW_DAILY)
+async def show_daily(ack, command):
+    await ack()
+    with_gui = 'gui' in command.get('text', '')
+    user = await get_user(command['user_id'])
+    daily = await get_daily(user.team)
+    # posted through the dispatcher, like the scheduled dailies, so the posts share the rate limits
+    await run_blocking(post_daily, interactive_client, command['channel_id'], daily, with_gui=with_gui)
+
+
+@app.command(SHOW_ANALYTICS)
+async def show_analytics(ack, respond, command):
+    await ack()
+    user = await get_user(command['user_id'])
+    if not user:
+        await respond("Please configure your team in the app's home tab first")
+        return
+    min_days, user_id = parse_analytics_command(user, command.get('text', ''))
+    # the analytics pipelines run on the synchronous mongo client, off the event loop
+    stuck_issues, dwell_times, submission_rates = await asyncio.gather(
+        run_blocking(get_stuck_issues, user.team, min_days, user_id),
+        run_blocking(get_status_dwell_times, user.team, user_id),
+        run_blocking(get_submission_rates, user.team, user_id)
+    )
+    for blocks in generate_team_analytics_message(user.team, min_days, stuck_issues, dwell_times, submission_rates):
+        await respond(text="Daily analytics", blocks=blocks)
+
+
+@app.command(ADD_TEAM)
+async def add_team(ack, respond, command):
+    await ack()
+    try:
+        team = parse_add_team_command(command['text'])
+    except ValueError as e:
+        await respond(str(e))
+        return
+    await save_team(team)
+    await respond(get_added_team_message(team))
+
+
+def run():
+    ensure_daily_indexes()
+    start_user_cache_invalidator()
+    start_issue_sync_worker()
+    start_jira_webhook_server()
+    start_daily_job_workers(slack_dispatcher)
+    start_daily_publisher(slack_dispatcher.with_priority(BULK))
+    start_analytics_worker()
+    server = app.server(port=int(os.environ.get("PORT", 3000)))
+    server.web_app.on_cleanup.append(close_async_jira_sessions)
+    server.start()
+
+
+if __name__ == '__main__':
+    run()
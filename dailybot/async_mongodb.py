@@ -0,0 +1,127 @@
+import os
+import time
+from datetime import date
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from dailybot.codec import decode, encode
+from dailybot.job_queue import Job
+from dailybot.mongodb import (User, Daily, DailyReport, Team, DailyDraft, MONGODB_URI, MONGODB_USERNAME,
+                              MONGODB_PASSWORD, CLUSTER_NAME, DAILY_DB, USERS_COLLECTION_NAME, TEAMS_COLLECTION_NAME,
+                              DAILIES_COLLECTION_NAME, JOBS_COLLECTION_NAME, DAILY_DRAFTS_COLLECTION_NAME,
+                              DAILY_HISTORY_BATCH_SIZE, users_cache, teams_cache)
+
+
+def get_async_database():
+    if os.environ.get(MONGODB_URI):
+        return AsyncIOMotorClient(os.environ[MONGODB_URI])
+    username = os.environ.get(MONGODB_USERNAME)
+    password = os.environ.get(MONGODB_PASSWORD)
+    cluster_name = os.environ.get(CLUSTER_NAME)
+
+    connection_string = f"mongodb+srv://{username}:{password}@{cluster_name}.mongodb.net/?retryWrites=true&w=majority"
+    return AsyncIOMotorClient(connection_string)
+
+
+@lru_cache()
+def get_async_daily_reports_database():
+    return get_async_database()[DAILY_DB]
+
+
+@lru_cache
+def get_async_collection(collection_name: str):
+    return get_async_daily_reports_database()[collection_name]
+
+
+async def get_user(user_id: str) -> Optional[User]:
+    user = users_cache.get(user_id)
+    if user:
+        return user
+    user: dict = await get_async_collection(USERS_COLLECTION_NAME).find_one({"_id": user_id})
+    if user:
+        user = decode(User, user)
+        users_cache.set(user_id, user)
+        return user
+
+
+async def save_user(user: User) -> User:
+    user.updated_at = time.time()
+    await get_async_collection(USERS_COLLECTION_NAME).replace_one({"_id": user._id}, encode(user), upsert=True)
+    users_cache.invalidate(user._id)
+    return user
+
+
+async def update_user_jira_keys(user: User, jira_keys: List[str]) -> User:
+    updated_at = time.time()
+    await get_async_collection(USERS_COLLECTION_NAME).update_one(
+        {"_id": user._id}, {"$set": {"jira_keys": jira_keys, "updated_at": updated_at}}
+    )
+    users_cache.invalidate(user._id)
+    user.jira_keys, user.updated_at = jira_keys, updated_at
+    return user
+
+
+async def get_daily(team: str, daily_date: Optional[str] = None) -> Daily:
+    daily_date = daily_date or str(date.today())
+    daily: dict = await get_async_collection(DAILIES_COLLECTION_NAME).find_one(
+        {"_id": Daily._format_id(daily_date, team)}
+    )
+    return decode(Daily, daily) if daily else Daily(team=team, date=daily_date)
+
+
+async def iter_daily_history(team: Optional[str] = None, start_date: Optional[str] = None,
+                             end_date: Optional[str] = None, user_id: Optional[str] = None,
+                             batch_size: int = DAILY_HISTORY_BATCH_SIZE) -> AsyncIterator[Daily]:
+    query, projection = Daily.history_query(team, start_date, end_date, user_id)
+    cursor = get_async_collection(DAILIES_COLLECTION_NAME).find(query, projection, sort=[("date", ASCENDING)],
+                                                                  batch_size=batch_size)
+    async for daily in cursor:
+        yield decode(Daily, daily)
+
+
+async def save_daily_report(daily: Daily, user_id: str, report: DailyReport,
+                            expected_version: Optional[int] = None) -> bool:
+    query, update, upsert = daily.report_write(user_id, report, expected_version)
+    try:
+        stored = await get_async_collection(DAILIES_COLLECTION_NAME).find_one_and_update(
+            query, update, upsert=upsert, projection={f"reports.{user_id}.version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        stored = None
+    if not stored:
+        return False
+    report.version = stored["reports"][user_id]["version"]
+    daily.reports[user_id] = report
+    return True
+
+
+async def get_daily_draft(user_id: str, daily_date: Optional[str] = None) -> DailyDraft:
+    daily_date = daily_date or str(date.today())
+    draft: dict = await get_async_collection(DAILY_DRAFTS_COLLECTION_NAME).find_one(
+        {"_id": DailyDraft._format_id(daily_date, user_id)}
+    )
+    return decode(DailyDraft, draft) if draft else DailyDraft(user_id=user_id, date=daily_date)
+
+
+async def save_daily_draft(draft: DailyDraft):
+    await get_async_collection(DAILY_DRAFTS_COLLECTION_NAME).replace_one({"_id": draft._id}, encode(draft), upsert=True)
+
+
+async def delete_daily_draft(draft: DailyDraft):
+    await get_async_collection(DAILY_DRAFTS_COLLECTION_NAME).delete_one({"_id": draft._id})
+
+
+async def save_team(team: Team):
+    await get_async_collection(TEAMS_COLLECTION_NAME).replace_one({"_id": team._id}, encode(team), upsert=True)
+    teams_cache.clear()
+
+
+async def enqueue_job(kind: str, payload: dict) -> Job:
+    job = Job(kind=kind, payload=payload)
+    await get_async_collection(JOBS_COLLECTION_NAME).insert_one(encode(job))
+    return job
@@ -1,17 +1,22 @@
+import hashlib
+import json
+import math
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple, Dict
 
-from jira import Issue
+from jira import Issue, Project
 from jira.resources import Status
 
 from dailybot.constants import (DAILY_MODAL_SUBMISSION, ACTIONS_ISSUE_DAILY_FORM, ISSUE_LINK_ACTION,
-                                ISSUE_SUMMERY_ACTION, GENERAL_COMMENTS_ACTION, BULK_ID_FORMAT, SAVE_USER_CONFIGURATIONS,
-                                SELECT_USER_TEAM, SELECT_USER_BOARD, JIRA_EMAIL_ACTION, JIRA_API_TOKEN_ACTION,
-                                JIRA_SERVER_ACTION, JiraHostType, JIRA_HOST_TYPE, MAX_LEN_SLACK_SELECTOR,
-                                TYPE_USER_BOARD, TYPE_OR_SELECT_USER_BOARD, SAVE_USER_BOARD, IGNORE_ISSUE_IN_DAILY_FORM,
-                                SELECT_STATUS_ISSUE_DAILY_FORM)
-from dailybot.jira_utils import get_jira_projects, get_optional_statuses
-from dailybot.mongodb import Team, User, SlackUserData, Daily, DailyIssueReport
+                                ISSUE_SUMMERY_ACTION, GENERAL_COMMENTS_ACTION, BULK_ID_FORMAT, BULK_ID_SEPERATOR,
+                                SAVE_USER_CONFIGURATIONS, SELECT_USER_TEAM, SELECT_USER_BOARD, JIRA_EMAIL_ACTION,
+                                JIRA_API_TOKEN_ACTION, JIRA_SERVER_ACTION, JiraHostType, JIRA_HOST_TYPE,
+                                MAX_LEN_SLACK_SELECTOR, TYPE_OR_SELECT_USER_BOARD, IGNORE_ISSUE_IN_DAILY_FORM,
+                                SELECT_STATUS_ISSUE_DAILY_FORM, DAILY_MODAL_NEXT_PAGE, DAILY_MODAL_PREVIOUS_PAGE,
+                                ISSUES_PER_DAILY_MODAL_PAGE, SLACK_SECTION_TEXT_LIMIT, SLACK_MESSAGE_BLOCKS_LIMIT)
+from dailybot.jira_utils import (get_jira_projects, get_optional_statuses, get_preloaded_statuses,
+                                 get_workflow_statuses)
+from dailybot.mongodb import Team, User, SlackUserData, Daily, DailyIssueReport, DailyDraft, DailyReport
 
 DIVIDER = {"type": "divider"}
 
@@ -44,9 +49,17 @@ class SlackSelectorOption:
         }
 
 
-def generate_issue_status_selector_component(status: Status, optional_statuses: List[str] = ISSUE_STATUSES) -> dict:
-    initial_option = SlackSelectorOption(status.name).as_dict()
-    options = [initial_option, *(SlackSelectorOption(s).as_dict() for s in optional_statuses if s != status.name)]
+def get_view_fingerprint(view: dict) -> str:
+    return hashlib.sha1(json.dumps(view, sort_keys=True).encode()).hexdigest()
+
+
+def generate_issue_status_selector_component(status: Status, optional_statuses: List[str] = ISSUE_STATUSES,
+                                              selected_status: Optional[str] = None) -> dict:
+    selected_status = selected_status or status.name
+    initial_option = SlackSelectorOption(selected_status).as_dict()
+    statuses = [status.name, *optional_statuses]
+    options = [initial_option, *(SlackSelectorOption(s).as_dict()
+                                 for s in dict.fromkeys(statuses) if s != selected_status)]
     return {
         "type": "static_select",
         "placeholder": {
@@ -60,11 +73,28 @@ def generate_issue_status_selector_component(status: Status, optional_statuses:
     }
 
 
-def generate_issue_report_component(user: User, issue: Issue, issue_reports: List[DailyIssueReport]):
+IGNORE_ISSUE_OPTION = {
+    "text": {
+        "type": "mrkdwn",
+        "text": "Ignore this issue"
+    },
+    "value": "ignore-issue"
+}
+
+
+def generate_issue_report_component(user: User, issue: Issue, issue_reports: List[DailyIssueReport],
+                                    draft: Optional[DailyDraft] = None):
     issue_report = None
     for report in issue_reports:
         if report.key == issue.key:
             issue_report = report
+    draft_report = draft.issue_reports.get(issue.key) if draft else None
+    ignored = bool(draft and issue.key in draft.ignored_keys)
+    optional_statuses = get_preloaded_statuses(issue)
+    if optional_statuses is None:
+        optional_statuses = get_workflow_statuses(user, issue)
+    if optional_statuses is None:
+        optional_statuses = get_optional_statuses(user=user, issue_key=issue.key)
     return [
         {
             "type": "header",
@@ -80,23 +110,14 @@ def generate_issue_report_component(user: User, issue: Issue, issue_reports: Lis
             "elements": [
                 {
                     "type": "checkboxes",
-                    "options": [
-                        {
-                            "text": {
-                                "type": "mrkdwn",
-                                "text": "Ignore this issue"
-                            },
-                            "value": "ignore-issue"
-                        }
-                    ],
+                    "options": [IGNORE_ISSUE_OPTION],
+                    **({"initial_options": [IGNORE_ISSUE_OPTION]} if ignored else {}),
                     "action_id": IGNORE_ISSUE_IN_DAILY_FORM
                 },
                 generate_issue_status_selector_component(
                     status=issue.get_field('status'),
-                    optional_statuses=get_optional_statuses(
-                        user=user,
-                        issue_key=issue.key
-                    )
+                    optional_statuses=optional_statuses,
+                    selected_status=draft_report.status if draft_report else None
                 ),
                 {
                     "type": "button",
@@ -117,6 +138,7 @@ def generate_issue_report_component(user: User, issue: Issue, issue_reports: Lis
             "optional": True,
             "element": {
                 "type": "plain_text_input",
+                **({"initial_value": draft_report.details} if draft_report and draft_report.details else {}),
                 "action_id": ISSUE_SUMMERY_ACTION
             },
             "label": {
@@ -139,16 +161,77 @@ def generate_issue_report_component(user: User, issue: Issue, issue_reports: Lis
     ]
 
 
-def generate_daily_modal(user: User, issues: List[Issue], daily: Daily):
+def generate_daily_modal_navigation(page: int, pages: int) -> List[dict]:
+    buttons = [
+        *([{
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "Previous",
+                "emoji": True
+            },
+            "value": str(page - 1),
+            "action_id": DAILY_MODAL_PREVIOUS_PAGE
+        }] if page > 0 else []),
+        *([{
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "Next",
+                "emoji": True
+            },
+            "value": str(page + 1),
+            "action_id": DAILY_MODAL_NEXT_PAGE
+        }] if page < pages - 1 else [])
+    ]
+    return [
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"Page {page + 1} of {pages}, your answers are kept when switching pages"
+                }
+            ]
+        },
+        {
+            "type": "actions",
+            "elements": buttons
+        }
+    ]
+
+
+def get_daily_modal_page(view: dict) -> Tuple[int, int]:
+    metadata = json.loads(view.get('private_metadata') or '{}')
+    return metadata.get('page', 0), metadata.get('pages', 1)
+
+
+def get_daily_modal_issue_keys(view: dict) -> List[str]:
+    """The issues of all the pages of a paginated modal, in the order they were shown"""
+    return json.loads(view.get('private_metadata') or '{}').get('issue_keys', [])
+
+
+def generate_daily_modal(user: User, issues: List[Issue], daily: Daily, page: int = 0,
+                         draft: Optional[DailyDraft] = None):
     reports = daily.reports.get(user.slack_data.user_id)
     issue_reports = reports.issue_reports if reports else []
+    pages = max(1, math.ceil(len(issues) / ISSUES_PER_DAILY_MODAL_PAGE))
+    page = min(max(page, 0), pages - 1)
+    page_issues = issues[page * ISSUES_PER_DAILY_MODAL_PAGE:(page + 1) * ISSUES_PER_DAILY_MODAL_PAGE]
     issue_report_components = [
         component
-        for issue in issues for component in generate_issue_report_component(user, issue, issue_reports)
+        for issue in page_issues for component in generate_issue_report_component(user, issue, issue_reports, draft)
     ]
+    is_last_page = page == pages - 1
     return {
         "type": "modal",
         "callback_id": DAILY_MODAL_SUBMISSION,
+        # a submission from any page reports the issues of the other pages too, without listing them again
+        "private_metadata": json.dumps({
+            "page": page,
+            "pages": pages,
+            **({"issue_keys": [issue.key for issue in issues]} if pages > 1 else {})
+        }),
         "submit": {
             "type": "plain_text",
             "text": "Submit",
@@ -175,13 +258,15 @@ def generate_daily_modal(user: User, issues: List[Issue], daily: Daily):
                 }
             },
             *issue_report_components,
-            {
+            *(generate_daily_modal_navigation(page, pages) if pages > 1 else []),
+            *([{
                 "type": "input",
                 "block_id": GENERAL_COMMENTS_ACTION,
                 "optional": True,
                 "element": {
                     "type": "plain_text_input",
                     "multiline": True,
+                    **({"initial_value": draft.general_comments} if draft and draft.general_comments else {}),
                     "action_id": GENERAL_COMMENTS_ACTION
                 },
                 "label": {
@@ -189,7 +274,7 @@ def generate_daily_modal(user: User, issues: List[Issue], daily: Daily):
                     "text": "Other comments / blockers",
                     "emoji": True
                 },
-            },
+            }] if is_last_page else []),
             *([{
                 "type": "context",
                 "elements": [
@@ -199,7 +284,47 @@ def generate_daily_modal(user: User, issues: List[Issue], daily: Daily):
                         "emoji": True
                     }
                 ]
-            }] if reports and reports.general_comments else []),
+            }] if is_last_page and reports and reports.general_comments else []),
+        ]
+    }
+
+
+def generate_loading_modal():
+    return {
+        "type": "modal",
+        "title": {
+            "type": "plain_text",
+            "text": "Daily Report",
+            "emoji": True
+        },
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": ":hourglass_flowing_sand: Loading your issues..."
+                }
+            }
+        ]
+    }
+
+
+def generate_daily_error_modal():
+    return {
+        "type": "modal",
+        "title": {
+            "type": "plain_text",
+            "text": "Daily Report",
+            "emoji": True
+        },
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": ":warning: Could not load your issues, please try again in a few minutes"
+                }
+            }
         ]
     }
 
@@ -347,8 +472,8 @@ def generate_home_tab_view(teams: List[Team]):
     }
 
 
-def generate_home_tab_view_set_jira_keys(user: User):
-    projects = get_jira_projects(user)
+def generate_home_tab_view_set_jira_keys(user: User, projects: Optional[List[Project]] = None):
+    projects = projects if projects is not None else get_jira_projects(user)
 
     if len(projects) < MAX_LEN_SLACK_SELECTOR:
         field = [{
@@ -370,46 +495,24 @@ def generate_home_tab_view_set_jira_keys(user: User):
             }
         }]
     else:
-        field = [
-            {
-                "type": "input",
-                "block_id": TYPE_OR_SELECT_USER_BOARD,
-                "label": {
+        field = [{
+            "type": "section",
+            "block_id": TYPE_OR_SELECT_USER_BOARD,
+            "text": {
+                "type": "mrkdwn",
+                "text": "*Search and select your Jira boards*"
+            },
+            "accessory": {
+                "type": "multi_external_select",
+                "placeholder": {
                     "type": "plain_text",
-                    "text": "Please write you issue keys:",
+                    "text": "Type a project key",
                     "emoji": True
                 },
-                "element": {
-                    "type": "plain_text_input",
-                    "action_id": TYPE_USER_BOARD
-                }
-            },
-            {
-                "type": "context",
-                "elements": [
-                    {
-                        "type": "plain_text",
-                        "text": "Please write the keys in a list like so: `EDGE,ULT` with , and no spaces",
-                        "emoji": True
-                    }
-                ]
-            },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Submit",
-                            "emoji": True
-                        },
-                        "value": SAVE_USER_BOARD,
-                        "action_id": SAVE_USER_BOARD
-                    }
-                ]
+                "min_query_length": 1,
+                "action_id": SELECT_USER_BOARD
             }
-        ]
+        }]
 
     return {
         "type": "home",
@@ -427,6 +530,10 @@ def generate_home_tab_view_set_jira_keys(user: User):
     }
 
 
+def generate_jira_projects_options(projects: List[Project]) -> dict:
+    return {"options": [SlackSelectorOption(text=project.key).as_dict() for project in projects]}
+
+
 def generate_home_tab_view_user_configured():
     return {
         "type": "home",
@@ -478,6 +585,62 @@ def generate_user_from_config_action(body: dict) -> User:
     )
 
 
+def parse_daily_view_state(view: dict) -> Tuple[Dict[str, DailyIssueReport], List[str], Optional[str]]:
+    general_comments = None
+    ignore = []
+    issues: Dict[str, DailyIssueReport] = {}
+    for key, value in view['state']['values'].items():
+        if key == GENERAL_COMMENTS_ACTION:
+            general_comments = value[key]['value']
+        else:
+            issue_key, action = key.split(BULK_ID_SEPERATOR)
+            issue_report = issues.get(issue_key, DailyIssueReport(key=issue_key))
+            if action == ISSUE_SUMMERY_ACTION:
+                issue_report.details = value[action]['value']
+            if action == ACTIONS_ISSUE_DAILY_FORM:
+                issue_report.status = value[SELECT_STATUS_ISSUE_DAILY_FORM]['selected_option']['value']
+                selected_options = value[IGNORE_ISSUE_IN_DAILY_FORM]['selected_options']
+                if selected_options and selected_options[0]['value'] == 'ignore-issue':
+                    ignore.append(issue_key)
+
+            issues[issue_key] = issue_report
+
+    return issues, ignore, general_comments
+
+
+def get_details_from_view(view: dict) -> Tuple[List[DailyIssueReport], Optional[str]]:
+    issues, ignore, general_comments = parse_daily_view_state(view)
+    for issue_to_ignore in ignore:
+        issues.pop(issue_to_ignore)
+
+    return list(issues.values()), general_comments
+
+
+def get_details_from_draft(draft: DailyDraft,
+                           issue_statuses: Dict[str, str]) -> Tuple[List[DailyIssueReport], Optional[str]]:
+    """issue_statuses maps the issues of the modal to their current status"""
+    issue_reports = []
+    for issue_key, status in issue_statuses.items():
+        if issue_key in draft.ignored_keys:
+            continue
+        issue_report = draft.issue_reports.get(issue_key)
+        if issue_report is None:
+            # pages the user never opened are reported as they are in jira, like the single page modal does
+            issue_report = DailyIssueReport(key=issue_key)
+            issue_report.status = status
+        issue_reports.append(issue_report)
+    return issue_reports, draft.general_comments
+
+
+def get_empty_daily_errors(view: dict) -> Dict[str, str]:
+    input_block_ids = [block['block_id'] for block in view.get('blocks', []) if block.get('type') == 'input']
+    if not input_block_ids:
+        return {}
+    # slack shows the error under an input block of the submitted page, the comments are only on the last one
+    block_id = GENERAL_COMMENTS_ACTION if GENERAL_COMMENTS_ACTION in input_block_ids else input_block_ids[0]
+    return {block_id: "Nothing to report, add a comment or keep at least one issue"}
+
+
 def generate_user_not_exists_modal():
     return {
         "type": "modal",
@@ -508,15 +671,40 @@ def generate_user_not_exists_modal():
     }
 
 
-def generate_text_section_if_not_empty(text):
+def split_text(text: str, limit: int = SLACK_SECTION_TEXT_LIMIT) -> List[str]:
+    """Splits text to parts under the limit, on line breaks when possible"""
+    parts = []
+    current = ''
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def generate_text_sections(text: str, text_type: str = "plain_text") -> List[dict]:
     return [{
         "type": "section",
         "text": {
-            "type": "plain_text",
-            "text": ":speech_balloon: " + text,
-            "emoji": True
+            "type": text_type,
+            "text": part,
+            **({"emoji": True} if text_type == "plain_text" else {})
         }
-    }] if text else []
+    } for part in split_text(text)]
+
+
+def generate_text_section_if_not_empty(text):
+    return generate_text_sections(":speech_balloon: " + text) if text else []
 
 
 def generate_issue_for_daily_message(current_user: User, user_id: str, issue: DailyIssueReport):
@@ -525,7 +713,7 @@ def generate_issue_for_daily_message(current_user: User, user_id: str, issue: Da
             "type": "section",
             "text": {
                 "type": "plain_text",
-                "text": f"{issue.key} - {issue.summary}",
+                "text": f"{issue.key} - {issue.summary}" if issue.summary else issue.key,
                 "emoji": True
             }
         },
@@ -542,7 +730,7 @@ def generate_issue_for_daily_message(current_user: User, user_id: str, issue: Da
                     "text": f"*<@{user_id}>*"
                 }
             ],
-            "accessory": {
+            **({"accessory": {
                 "type": "button",
                 "text": {
                     "type": "plain_text",
@@ -552,7 +740,7 @@ def generate_issue_for_daily_message(current_user: User, user_id: str, issue: Da
                 "value": "click_me_123",
                 "url": issue.link,
                 "action_id": "button-action"
-            }
+            }} if issue.link else {})
         },
         *generate_text_section_if_not_empty(issue.details),
         DIVIDER
@@ -581,14 +769,7 @@ def generate_general_comments_with_gui(general_comments: str, user_id: str):
                 }
             ]
         },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": general_comments,
-                "emoji": True
-            }
-        },
+        *generate_text_sections(general_comments),
         DIVIDER
     ]
 
@@ -607,45 +788,120 @@ def generate_daily_for_user_with_gui(user: User, daily: Daily):
     ]
 
 
-def generate_daily_message(user: User, daily: Daily, with_gui: bool = False):
+def generate_issue_report_link(issue: DailyIssueReport) -> str:
+    title = issue.summary or issue.key
+    return f"<{issue.link}|{title}>" if issue.link else title
+
+
+def generate_daily_report_text(user_id: str, report: DailyReport) -> str:
+    return '\n'.join([
+        f"<@{user_id}>:",
+        '\n'.join([
+            f" - {generate_issue_report_link(issue)} - {issue.status}{f' - {issue.details}' if issue.details else ''}"
+            for issue in report.issue_reports
+        ])
+    ]) + (f"\n - {report.general_comments}" if report.general_comments else '')
+
+
+def generate_daily_header(daily: Daily) -> List[dict]:
+    return [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"Daily Report for {daily.date}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "plain_text",
+                    "text": "Feel free to extend and comment in the thread.",
+                    "emoji": True
+                }
+            ]
+        }
+    ]
+
+
+def pack_blocks(blocks: List[dict], first_message_blocks: List[dict] = None,
+                limit: int = SLACK_MESSAGE_BLOCKS_LIMIT) -> List[List[dict]]:
+    messages = [list(first_message_blocks or [])]
+    for block in blocks:
+        if len(messages[-1]) >= limit:
+            messages.append([])
+        messages[-1].append(block)
+    return messages
+
+
+def generate_daily_message_chunks(user: User, daily: Daily, with_gui: bool = False) -> List[List[dict]]:
+    """Renders the daily as a list of messages, each under slack's text and block limits.
+    The first message is meant for the channel and the rest for its thread."""
     if with_gui:
         blocks = [component for daily_report in generate_daily_for_user_with_gui(user, daily)
                   for component in daily_report]
     else:
-        text = '\n'.join([
-            '\n'.join([
-                f"<@{user_id}>:",
-                '\n'.join([
-                    f" - <{issue.link}|{issue.summary}> - {issue.status}{f' - {issue.details}' if issue.details else ''}"
-                    for issue in report.issue_reports
-                ])
-            ]) + (f"\n - {report.general_comments}" if report.general_comments else '')
-            for user_id, report in daily.reports.items()])
+        # users are packed together to keep the compact layout, a user is split only if its own text is too long
+        texts = [part for user_id, report in daily.reports.items()
+                 for part in split_text(generate_daily_report_text(user_id, report))]
+        sections = []
+        for text in texts:
+            if sections and len(sections[-1]) + 1 + len(text) <= SLACK_SECTION_TEXT_LIMIT:
+                sections[-1] = f"{sections[-1]}\n{text}"
+            else:
+                sections.append(text)
         blocks = [{
             "type": "section",
             "text": {
                 "type": "mrkdwn",
                 "text": text
             }
-        }] if text else []
-    return [
-        {
+        } for text in sections]
+    return pack_blocks(blocks, first_message_blocks=generate_daily_header(daily))
+
+
+def generate_team_analytics_message(team: str, min_days: int, stuck_issues: List[dict], dwell_times: List[dict],
+                                    submission_rates: List[dict]) -> List[List[dict]]:
+    def header(text: str) -> dict:
+        return {
             "type": "header",
             "text": {
                 "type": "plain_text",
-                "text": f"Daily Report for {daily.date}",
+                "text": text,
                 "emoji": True
             }
-        },
+        }
+
+    stuck_text = '\n'.join(
+        f" - <@{issue['user_id']}> {issue['key']} - {issue['status']} for {issue['days']} reports "
+        f"(since {issue['start_date']})"
+        for issue in stuck_issues
+    ) or "No stuck issues :tada:"
+    dwell_text = '\n'.join(
+        f" - {status['_id']}: {status['average_days']:.1f} dailies on average, up to {status['max_days']} "
+        f"({status['streaks']} issues)"
+        for status in dwell_times
+    ) or "Nothing reported yet"
+    rates_text = '\n'.join(
+        f" - <@{rate['user_id']}>: {rate['rate']:.0%} ({rate['submitted']} of {rate['days']} dailies)"
+        for rate in submission_rates if rate.get('rate') is not None
+    ) or "Nothing reported yet"
+    return pack_blocks([
+        header(f"Issues in the same status for {min_days}+ reports"),
+        *generate_text_sections(stuck_text, text_type="mrkdwn"),
         {
             "type": "context",
             "elements": [
                 {
-                    "type": "plain_text",
-                    "text": "Feel free to extend and comment in the thread.",
-                    "emoji": True
+                    "type": "mrkdwn",
+                    "text": "Counts reports up to the team's last closed daily, days without a report don't reset it"
                 }
             ]
         },
-        *blocks,
-    ]
+        header("Status dwell time"),
+        *generate_text_sections(dwell_text, text_type="mrkdwn"),
+        header("Daily submission rate"),
+        *generate_text_sections(rates_text, text_type="mrkdwn"),
+    ], first_message_blocks=[header(f"Daily analytics for {team}")])
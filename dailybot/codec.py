@@ -0,0 +1,143 @@
+import itertools
+from dataclasses import fields, is_dataclass, MISSING, Field
+from functools import wraps
+from threading import RLock
+from typing import Any, Callable, Dict, List, Type, TypeVar, Union, get_type_hints, get_args, get_origin
+
+T = TypeVar("T")
+
+Decoder = Callable[[dict], Any]
+Encoder = Callable[[Any], dict]
+
+_decoders: Dict[type, Decoder] = {}
+_encoders: Dict[type, Encoder] = {}
+_lock = RLock()  # building a class's converter builds the converters of its fields
+
+
+def slotted(cls: Type[T]) -> Type[T]:
+    """Recreates a dataclass with __slots__, like dataclass(slots=True) does on python 3.10+"""
+    names = tuple(f.name for f in fields(cls))
+    cls_dict = dict(cls.__dict__)
+    for name in names:
+        cls_dict.pop(name, None)  # the defaults are kept by the generated __init__
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    cls_dict["__slots__"] = names
+
+    # before python 3.10 the generated __init__ leaves init=False fields to the class attributes removed above
+    class_defaults = [(f.name, f.default) for f in fields(cls) if not f.init and f.default is not MISSING]
+    if class_defaults:
+        dataclass_init = cls_dict["__init__"]
+
+        @wraps(dataclass_init)
+        def __init__(self, *args, **kwargs):
+            for name, default in class_defaults:
+                object.__setattr__(self, name, default)
+            dataclass_init(self, *args, **kwargs)
+        cls_dict["__init__"] = __init__
+
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls
+
+
+class _CodeBuilder:
+    """Turns field types to python expressions, so each class is inspected once and not on every document"""
+
+    def __init__(self, namespace: dict, convert: Callable[[type], Callable]):
+        self.namespace = namespace
+        self.convert = convert
+        self._names = itertools.count()
+
+    def expression(self, tp, value: str) -> str:
+        origin, args = get_origin(tp), get_args(tp)
+        if origin is Union:
+            types = [arg for arg in args if arg is not type(None)]
+            inner = self.expression(types[0], value) if len(types) == 1 else value
+            return value if inner == value else f"(None if {value} is None else {inner})"
+        if is_dataclass(tp):
+            name = f"_convert_{next(self._names)}"
+            self.namespace[name] = self.convert(tp)
+            return f"{name}({value})"
+        if origin in (list, List) and args:
+            item = f"_item_{next(self._names)}"
+            inner = self.expression(args[0], item)
+            return value if inner == item else f"[{inner} for {item} in {value}]"
+        if origin in (dict, Dict) and len(args) == 2:
+            key, item = f"_key_{next(self._names)}", f"_item_{next(self._names)}"
+            inner = self.expression(args[1], item)
+            return value if inner == item else f"{{{key}: {inner} for {key}, {item} in {value}.items()}}"
+        return value  # documents hold plain values, they are used as they are
+
+
+def _default_expression(f: Field, namespace: dict) -> str:
+    if f.default is not MISSING:
+        namespace[f"_default_{f.name}"] = f.default
+        return f"_default_{f.name}"
+    namespace[f"_default_{f.name}"] = f.default_factory
+    return f"_default_{f.name}()"
+
+
+def _compile(source: str, namespace: dict, name: str) -> Callable:
+    exec(source, namespace)
+    return namespace[name]
+
+
+def _build_decoder(cls: type) -> Decoder:
+    hints = get_type_hints(cls)
+    namespace = {"_cls": cls}
+    builder = _CodeBuilder(namespace, get_decoder)
+    arguments, assignments = [], []
+    for f in fields(cls):
+        value = builder.expression(hints[f.name], f"data[{f.name!r}]")
+        has_default = f.default is not MISSING or f.default_factory is not MISSING
+        if not f.init:
+            assignments.append(f"    if {f.name!r} in data:\n        obj.{f.name} = {value}")
+        elif has_default:
+            arguments.append(f"{f.name}={value} if {f.name!r} in data else {_default_expression(f, namespace)}")
+        else:
+            arguments.append(f"{f.name}={value}")
+    source = "\n".join([
+        "def decode(data):",
+        f"    obj = _cls({', '.join(arguments)})",
+        *assignments,
+        "    return obj",
+    ])
+    return _compile(source, namespace, "decode")
+
+
+def _build_encoder(cls: type) -> Encoder:
+    hints = get_type_hints(cls)
+    namespace = {}
+    builder = _CodeBuilder(namespace, get_encoder)
+    items = [f"{f.name!r}: {builder.expression(hints[f.name], f'obj.{f.name}')}" for f in fields(cls)]
+    source = f"def encode(obj):\n    return {{{', '.join(items)}}}"
+    return _compile(source, namespace, "encode")
+
+
+def _get_or_build(cache: dict, cls: type, build: Callable[[type], Callable]) -> Callable:
+    converter = cache.get(cls)
+    if converter is None:
+        with _lock:
+            converter = cache.get(cls)
+            if converter is None:
+                converter = cache[cls] = build(cls)
+    return converter
+
+
+def get_decoder(cls: Type[T]) -> Callable[[dict], T]:
+    return _get_or_build(_decoders, cls, _build_decoder)
+
+
+def get_encoder(cls: type) -> Encoder:
+    return _get_or_build(_encoders, cls, _build_encoder)
+
+
+def decode(cls: Type[T], data: dict) -> T:
+    """Replaces dacite.from_dict for the stored models, missing required keys raise KeyError"""
+    return get_decoder(cls)(data)
+
+
+def encode(obj: Any) -> dict:
+    """Replaces dataclasses.asdict for the stored models, plain values are not copied"""
+    return get_encoder(type(obj))(obj)
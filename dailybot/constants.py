@@ -3,6 +3,7 @@ from enum import Enum
 DAILY_MODAL = "daily"
 ADD_TEAM = "/add-team-daily"
 SHOW_DAILY = "/show-daily-report"
+SHOW_ANALYTICS = "/daily-analytics"
 DAILY_MODAL_SUBMISSION = "daily_modal_submission"
 ACTIONS_ISSUE_DAILY_FORM = "actions_issue_daily_form"
 SELECT_STATUS_ISSUE_DAILY_FORM = "select_status_issue_daily_form"
@@ -13,18 +14,31 @@ SAVE_USER_CONFIGURATIONS = "save_user_configurations"
 SELECT_USER_TEAM = "select_user_team"
 TYPE_OR_SELECT_USER_BOARD = "type_or_select_user_board"
 SELECT_USER_BOARD = "select_user_board"
-TYPE_USER_BOARD = "type_user_board"
-SAVE_USER_BOARD = "save_user_board"
 JIRA_HOST_TYPE = "jira_host_type"
 JIRA_SERVER_ACTION = 'jira_server_url_action'
 JIRA_EMAIL_ACTION = 'jira_email_action'
 JIRA_API_TOKEN_ACTION = 'jira_api_token_action'
 IGNORE_ISSUE_IN_DAILY_FORM = 'ignore-issue-in-daily-form'
+DAILY_MODAL_NEXT_PAGE = 'daily_modal_next_page'
+DAILY_MODAL_PREVIOUS_PAGE = 'daily_modal_previous_page'
 
 BULK_ID_SEPERATOR = "|"
 BULK_ID_FORMAT = "{key}" + BULK_ID_SEPERATOR + "{action}"
 
 MAX_LEN_SLACK_SELECTOR = 100
+# each issue takes up to 5 blocks and slack allows 100 blocks in a modal
+ISSUES_PER_DAILY_MODAL_PAGE = 15
+# https://api.slack.com/reference/block-kit/blocks
+SLACK_SECTION_TEXT_LIMIT = 3000
+SLACK_MESSAGE_BLOCKS_LIMIT = 50
+
+# keys of the jira status categories of issues that are not reported in the daily,
+# unlike the category names ("To Do", "Done") they don't change with the site's language
+EXCLUDED_STATUS_CATEGORIES = ("new", "done")
+
+DAILY_MODAL_FIRST_VIEW_METRIC = "daily_modal.time_to_first_view"
+DAILY_MODAL_FULL_VIEW_METRIC = "daily_modal.time_to_full_view"
+HOME_TAB_SKIPPED_METRIC = "home_tab.skipped_publishes"
 
 
 class JiraHostType(Enum):
@@ -0,0 +1,86 @@
+import logging
+import os
+from dataclasses import asdict
+from typing import Optional
+
+from dailybot.daily_publisher import update_posted_daily
+from dailybot.issue_sync import sync_user_issues
+from dailybot.job_queue import job_handler, enqueue, Job, JobWorkerPool, start_job_workers
+from dailybot.jira_utils import update_daily_report_status_and_enrich_status
+from dailybot.mongodb import User, Daily
+from dailybot.slack_dispatcher import SlackDispatcher, DispatchingClient, BACKGROUND
+
+DAILY_SUBMISSION_JOB = "daily_submission"
+DAILY_MESSAGE_UPDATE_JOB = "daily_message_update"
+DAILY_MESSAGE_UPDATE_DEBOUNCE = "DAILY_MESSAGE_UPDATE_DEBOUNCE"
+DEFAULT_DAILY_MESSAGE_UPDATE_DEBOUNCE = 30
+
+logger = logging.getLogger(__name__)
+
+_slack_dispatcher: Optional[SlackDispatcher] = None
+
+
+def start_daily_job_workers(slack_dispatcher: SlackDispatcher, workers: Optional[int] = None) -> JobWorkerPool:
+    """Starts the job workers with the process's dispatcher, so the jobs share its rate limits"""
+    global _slack_dispatcher
+    _slack_dispatcher = slack_dispatcher
+    return start_job_workers(workers)
+
+
+def get_slack_client() -> DispatchingClient:
+    if _slack_dispatcher is None:
+        raise RuntimeError("Job workers were started without a slack dispatcher")
+    return _slack_dispatcher.with_priority(BACKGROUND)
+
+
+def get_daily_submission_payload(user: User, daily: Daily) -> dict:
+    return {"user_id": user.slack_data.user_id, "team": daily.team, "date": daily.date}
+
+
+def enqueue_daily_submission(user: User, daily: Daily) -> Job:
+    return enqueue(DAILY_SUBMISSION_JOB, get_daily_submission_payload(user, daily))
+
+
+def enqueue_daily_message_update(daily: Daily) -> Job:
+    # submissions that arrive while an update is pending are folded into it, so a burst becomes one edit
+    return enqueue(
+        DAILY_MESSAGE_UPDATE_JOB,
+        {"team": daily.team, "date": daily.date},
+        delay=float(os.environ.get(DAILY_MESSAGE_UPDATE_DEBOUNCE, DEFAULT_DAILY_MESSAGE_UPDATE_DEBOUNCE)),
+        dedupe_key=f"{DAILY_MESSAGE_UPDATE_JOB}|{daily.formatted_id}"
+    )
+
+
+@job_handler(DAILY_SUBMISSION_JOB)
+def process_daily_submission(payload: dict) -> dict:
+    user = User.get_from_db(payload["user_id"])
+    daily = Daily.get_from_db(payload["team"], payload["date"])
+    if not (user and user.slack_data.user_id in daily.reports):
+        return {"results": []}
+
+    user_id = user.slack_data.user_id
+    report = daily.reports[user_id]
+    results = update_daily_report_status_and_enrich_status(user=user, daily=daily, logger=logger)
+    if any(result.success and result.transition for result in results):
+        # the snapshot still holds the old statuses and transitions, the next daily modal renders from it
+        try:
+            sync_user_issues(user)
+        except Exception as e:
+            logger.error(f"Error syncing issues of {user_id} after their transitions: {e}")
+    if not daily.save_report(user_id, report, expected_version=report.version):
+        # the user submitted again meanwhile, the newer submission has its own job
+        logger.info(f"Daily report of {user_id} changed during enrichment, keeping the newer one")
+        return {"results": [asdict(result) for result in results], "superseded": True}
+    if daily.posted:
+        enqueue_daily_message_update(daily)
+    return {"results": [asdict(result) for result in results]}
+
+
+@job_handler(DAILY_MESSAGE_UPDATE_JOB)
+def process_daily_message_update(payload: dict) -> dict:
+    daily = Daily.get_from_db(payload["team"], payload["date"])
+    calls = {
+        channel: update_posted_daily(get_slack_client(), daily, posted_daily)
+        for channel, posted_daily in daily.posted.items()
+    }
+    return {"calls": calls}
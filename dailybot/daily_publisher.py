@@ -0,0 +1,184 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Thread, Event
+from typing import List, Optional
+
+from slack_sdk.web import SlackResponse
+
+from dailybot.block_utils import generate_daily_message_chunks, get_view_fingerprint
+from dailybot.metrics import record_timing, increment
+from dailybot.mongodb import Team, Daily, PostedDaily, PostedMessage
+from dailybot.slack_dispatcher import DispatchingClient
+
+DAILY_PUBLISH_CONCURRENCY = "DAILY_PUBLISH_CONCURRENCY"
+DEFAULT_DAILY_PUBLISH_CONCURRENCY = 4
+PUBLISH_CHECK_INTERVAL = 30
+PUBLISH_TIME_FORMAT = "%H:%M"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PublishResult:
+    team: str
+    success: bool
+    elapsed: float
+    skipped: bool = False
+    error: Optional[str] = None
+
+
+def parse_publish_time(value: str) -> str:
+    """Normalizes a publish time to HH:MM, so due teams can be found by comparing strings"""
+    return datetime.strptime(value, PUBLISH_TIME_FORMAT).strftime(PUBLISH_TIME_FORMAT)
+
+
+def post_daily_message(client: DispatchingClient, channel: str, chunks: List[List[dict]]) -> List[SlackResponse]:
+    """Posts the first chunk to the channel and the overflow as replies in its thread"""
+    first, *overflow = chunks
+    responses = [client.chat_postMessage(channel=channel, text="Daily Report", blocks=first)]
+    for blocks in overflow:
+        responses.append(client.chat_postMessage(channel=channel, text="Daily Report (continued)", blocks=blocks,
+                                                 thread_ts=responses[0]["ts"]))
+    return responses
+
+
+def get_blocks_fingerprint(blocks: List[dict]) -> str:
+    return get_view_fingerprint({"blocks": blocks})
+
+
+def post_daily(client: DispatchingClient, channel: str, daily: Daily, with_gui: bool = False) -> PostedDaily:
+    """Posts the daily and records its messages, so later submissions can update them in place"""
+    chunks = generate_daily_message_chunks(None, daily, with_gui=with_gui)
+    responses = post_daily_message(client, channel, chunks)
+    posted_daily = PostedDaily(channel=channel, with_gui=with_gui, messages=[
+        PostedMessage(ts=response["ts"], fingerprint=get_blocks_fingerprint(blocks))
+        for response, blocks in zip(responses, chunks)
+    ])
+    daily.set_posted(posted_daily)
+    return posted_daily
+
+
+def update_posted_daily(client: DispatchingClient, daily: Daily, posted_daily: PostedDaily) -> int:
+    """Edits only the posted messages whose rendering changed, returns the number of slack calls made"""
+    chunks = generate_daily_message_chunks(None, daily, with_gui=posted_daily.with_gui)
+    messages, calls = posted_daily.messages, 0
+    thread_ts = messages[0].ts
+    try:
+        for i, blocks in enumerate(chunks):
+            fingerprint = get_blocks_fingerprint(blocks)
+            if i >= len(messages):
+                response = client.chat_postMessage(channel=posted_daily.channel, text="Daily Report (continued)",
+                                                   blocks=blocks, thread_ts=thread_ts)
+                messages.append(PostedMessage(ts=response["ts"], fingerprint=fingerprint))
+                calls += 1
+            elif messages[i].fingerprint != fingerprint:
+                client.chat_update(channel=posted_daily.channel, ts=messages[i].ts, text="Daily Report", blocks=blocks)
+                messages[i].fingerprint = fingerprint
+                calls += 1
+        while len(messages) > len(chunks):
+            client.chat_delete(channel=posted_daily.channel, ts=messages[-1].ts)
+            messages.pop()
+            calls += 1
+    finally:
+        # a failing call must not lose the posted messages and fingerprints of the calls before it,
+        # otherwise the next update posts duplicates and edits unchanged messages again
+        if calls:
+            daily.set_posted(posted_daily)
+        increment("daily_publisher.message_updates", calls)
+    return calls
+
+
+def release_publish(team: Team, daily: Daily):
+    try:
+        # the next check publishes it again
+        team.release_publish(daily.date)
+    except Exception as e:
+        logger.error(f"Could not release the daily of {team.name} for another attempt: {e}")
+
+
+def publish_daily(client: DispatchingClient, team: Team, daily: Daily) -> PublishResult:
+    started = time.perf_counter()
+    if not daily.reports:
+        # reports submitted later today are published by a later check
+        release_publish(team, daily)
+        return PublishResult(team=team.name, success=True, elapsed=time.perf_counter() - started, skipped=True)
+    try:
+        post_daily(client, team.daily_channel, daily)
+    except Exception as e:
+        increment("daily_publisher.failures")
+        release_publish(team, daily)
+        return PublishResult(team=team.name, success=False, elapsed=time.perf_counter() - started, error=str(e))
+    elapsed = time.perf_counter() - started
+    record_timing("daily_publisher.publish", elapsed)
+    return PublishResult(team=team.name, success=True, elapsed=elapsed)
+
+
+def publish_dailies(client: DispatchingClient, teams: List[Team], daily_date: Optional[str] = None,
+                    max_workers: Optional[int] = None) -> List[PublishResult]:
+    if not teams:
+        return []
+    dailies = Daily.get_many_from_db([team.name for team in teams], daily_date)
+    max_workers = max_workers or int(os.environ.get(DAILY_PUBLISH_CONCURRENCY, DEFAULT_DAILY_PUBLISH_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(teams))) as executor:
+        results = list(executor.map(lambda team: publish_daily(client, team, dailies[team.name]), teams))
+
+    for result in results:
+        if result.skipped:
+            # checked again until someone reports
+            logger.debug(f"Nothing reported yet in the daily of {result.team}")
+        elif result.success:
+            logger.info(f"Published daily of {result.team} in {result.elapsed:.2f}s")
+        else:
+            logger.error(f"Could not publish daily of {result.team}: {result.error}")
+    return results
+
+
+def get_team_publish_time(team: Team) -> Optional[str]:
+    if not team.publish_time:
+        return None
+    try:
+        return parse_publish_time(team.publish_time)  # teams added before it was validated
+    except ValueError:
+        logger.error(f"Team {team.name} has an invalid publish time `{team.publish_time}`")
+        return None
+
+
+def get_due_teams(now: datetime) -> List[Team]:
+    today, current_time = str(now.date()), now.strftime(PUBLISH_TIME_FORMAT)
+    due_teams = []
+    for team in Team.get_all_teams_from_db():
+        publish_time = get_team_publish_time(team)
+        if (publish_time and publish_time <= current_time and team.last_published_date != today
+                and team.claim_publish(today)):  # another process may publish the same team
+            due_teams.append(team)
+    return due_teams
+
+
+class DailyPublisher(Thread):
+    def __init__(self, client: DispatchingClient, interval: float = PUBLISH_CHECK_INTERVAL):
+        super().__init__(name="daily-publisher", daemon=True)
+        self.client = client
+        self.interval = interval
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                now = datetime.now()
+                publish_dailies(self.client, get_due_teams(now), str(now.date()))
+            except Exception as e:
+                logger.error(f"Error publishing dailies: {e}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_daily_publisher(client: DispatchingClient) -> DailyPublisher:
+    publisher = DailyPublisher(client)
+    publisher.start()
+    return publisher
@@ -0,0 +1,67 @@
+import fcntl
+import os
+
+from dailybot.analytics import start_analytics_worker
+from dailybot.daily_jobs import start_daily_job_workers
+from dailybot.daily_publisher import start_daily_publisher
+from dailybot.issue_sync import start_issue_sync_worker
+from dailybot.jira_pool import jira_client_pool
+from dailybot.main import slack_dispatcher
+from dailybot.mongodb import get_daily_reports_database, get_collection, users_cache, ensure_daily_indexes
+from dailybot.slack_dispatcher import BULK
+from dailybot.user_cache import start_user_cache_invalidator
+
+ISSUE_SYNC_LOCK_FILE = os.environ.get("ISSUE_SYNC_LOCK_FILE", "/tmp/dailybot-issue-sync.lock")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+threads = int(os.environ.get("WEB_THREADS", 8))
+worker_class = "gthread"
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+accesslog = "-"
+
+_job_workers = None
+_issue_sync_lock = None
+
+
+def reset_process_state():
+    # mongo clients and pooled jira sessions must not be shared with the parent process
+    get_collection.cache_clear()
+    get_daily_reports_database.cache_clear()
+    jira_client_pool.close()
+    # invalidations sent before the fork never reach the worker's change stream
+    users_cache.clear()
+
+
+def _acquire_issue_sync_lock():
+    lock = open(ISSUE_SYNC_LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def post_fork(server, worker):
+    global _job_workers, _issue_sync_lock
+    reset_process_state()
+    start_user_cache_invalidator()
+    _job_workers = start_daily_job_workers(slack_dispatcher)
+    # only one process syncs issues and publishes dailies,
+    # the lock is released if it dies so a replacement worker takes over
+    _issue_sync_lock = _acquire_issue_sync_lock()
+    if _issue_sync_lock:
+        ensure_daily_indexes()
+        start_issue_sync_worker()
+        start_daily_publisher(slack_dispatcher.with_priority(BULK))
+        start_analytics_worker()
+
+
+def worker_exit(server, worker):
+    if _job_workers:
+        _job_workers.stop(timeout=graceful_timeout)
+    if _issue_sync_lock:
+        _issue_sync_lock.close()
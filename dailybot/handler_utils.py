@@ -0,0 +1,81 @@
+from typing import List, Optional, Tuple
+
+from dailybot.analytics import DEFAULT_STUCK_DAYS
+from dailybot.block_utils import (generate_daily_modal, get_details_from_view, get_details_from_draft,
+                                  get_daily_modal_page, get_daily_modal_issue_keys, parse_daily_view_state,
+                                  get_view_fingerprint)
+from dailybot.constants import ADD_TEAM, TYPE_OR_SELECT_USER_BOARD, SELECT_USER_BOARD, HOME_TAB_SKIPPED_METRIC
+from dailybot.daily_publisher import parse_publish_time
+from dailybot.issue_sync import get_user_issues, get_snapshot_statuses
+from dailybot.jira_utils import get_issue_browse_link
+from dailybot.metrics import increment
+from dailybot.mongodb import User, Daily, DailyReport, DailyDraft, Team
+
+
+def render_daily_modal(user: User, daily: Daily, draft: Optional[DailyDraft], page: int = 0) -> dict:
+    return generate_daily_modal(user=user, issues=get_user_issues(user), daily=daily, page=page, draft=draft)
+
+
+def is_paginated(view: dict) -> bool:
+    _, pages = get_daily_modal_page(view)
+    return pages > 1
+
+
+def get_submitted_report(user: User, view: dict, draft: Optional[DailyDraft]) -> Optional[DailyReport]:
+    """The report of a submitted daily modal, draft holds the other pages of a paginated modal.
+    Returns None if nothing was reported."""
+    if draft:
+        draft.update_page(*parse_daily_view_state(view))
+        # slack expects the submission's ack within 3 seconds, so the snapshot is read as it is, never synced
+        issue_statuses = get_snapshot_statuses(user, get_daily_modal_issue_keys(view))
+        issue_reports, general_comments = get_details_from_draft(draft, issue_statuses)
+    else:
+        issue_reports, general_comments = get_details_from_view(view)
+    if not (issue_reports or general_comments):
+        return None
+    for issue_report in issue_reports:
+        # the daily can be posted before the job enriches the report with the jira permalink and summary
+        issue_report.link = issue_report.link or get_issue_browse_link(user.jira_server_url, issue_report.key)
+    return DailyReport(issue_reports=issue_reports, general_comments=general_comments)
+
+
+def get_selected_jira_keys(body: dict) -> List[str]:
+    return [
+        option['value']
+        for option in body['view']['state']['values'][TYPE_OR_SELECT_USER_BOARD][SELECT_USER_BOARD]['selected_options']
+    ]
+
+
+def parse_add_team_command(text: str) -> Team:
+    """Raises ValueError with the message to answer the user"""
+    args = text.split()
+    if len(args) not in (2, 3):
+        raise ValueError(f"Usage: {ADD_TEAM} <team> <daily channel> [publish time HH:MM]")
+    name, daily_channel, *publish_time = args
+    try:
+        publish_time = parse_publish_time(publish_time[0]) if publish_time else None
+    except ValueError:
+        raise ValueError(f"Invalid publish time `{publish_time[0]}`, expected HH:MM, e.g. 09:30")
+    return Team(name, daily_channel, publish_time)
+
+
+def get_added_team_message(team: Team) -> str:
+    return (f"Added team {team.name} with daily channel {team.daily_channel}"
+            f"{f', published daily at {team.publish_time}' if team.publish_time else ''}")
+
+
+def parse_analytics_command(user: User, text: str) -> Tuple[int, Optional[str]]:
+    """Returns the minimal streak of stuck issues and the user to limit the analytics to, if any"""
+    args = text.split()
+    min_days = next((int(arg) for arg in args if arg.isdigit()), DEFAULT_STUCK_DAYS)
+    return min_days, user.slack_data.user_id if 'me' in args else None
+
+
+def get_home_tab_to_publish(view: dict, published_view: Optional[dict] = None) -> Optional[dict]:
+    """The home tab view with its fingerprint, None if it is already published"""
+    fingerprint = get_view_fingerprint(view)
+    # slack sends the currently published view with app_home_opened, so an unchanged render can be skipped
+    if published_view and published_view.get('private_metadata') == fingerprint:
+        increment(HOME_TAB_SKIPPED_METRIC)
+        return None
+    return {**view, "private_metadata": fingerprint}
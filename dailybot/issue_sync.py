@@ -0,0 +1,204 @@
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from itertools import groupby
+from threading import Thread, Event
+from typing import List, Optional, Dict, Tuple
+
+from jira import Issue
+
+from dailybot.jira_utils import (get_my_issues, search_all_issues, get_my_issues_jql, issue_from_raw,
+                                 get_max_workers, get_jira_account_id, get_issue_assignee_id,
+                                 get_excluded_status_categories_jql, get_jira_host, MY_ISSUES_FIELDS)
+from dailybot.mongodb import User, IssueSnapshot, Team, get_users
+
+ISSUE_SYNC_INTERVAL = "ISSUE_SYNC_INTERVAL"
+ISSUE_SNAPSHOT_MAX_STALENESS = "ISSUE_SNAPSHOT_MAX_STALENESS"
+TEAM_PREFETCH_TIME = "TEAM_PREFETCH_TIME"  # local HH:MM, before the daily window
+DEFAULT_ISSUE_SYNC_INTERVAL = 5 * 60
+DEFAULT_ISSUE_SNAPSHOT_MAX_STALENESS = 15 * 60
+SYNC_OVERLAP_MINUTES = 2
+
+logger = logging.getLogger(__name__)
+
+
+def get_changed_issues_jql(user: User, since_minutes: int) -> str:
+    # relative dates avoid depending on the timezone jira uses to evaluate absolute dates
+    return (f'project in ({", ".join(user.jira_keys)}) and updated >= -{since_minutes}m '
+            f'and (assignee = currentUser() or assignee changed from currentUser() after -{since_minutes}m)')
+
+
+def get_issue_order(issue_key: str) -> Tuple[str, int]:
+    """Project then issue number, so PROJ-9 comes before PROJ-10"""
+    project, _, number = issue_key.rpartition('-')
+    return project, int(number) if number.isdigit() else 0
+
+
+def sync_user_issues(user: User, full: bool = False) -> IssueSnapshot:
+    snapshot = IssueSnapshot.get_from_db(user.slack_data.user_id) or IssueSnapshot(user_id=user.slack_data.user_id)
+    now = time.time()
+    jira_host = get_jira_host(user.jira_server_url)
+
+    if full or not snapshot.last_sync or snapshot.jira_keys != user.jira_keys or snapshot.jira_host != jira_host:
+        snapshot.issues = {issue.key: issue.raw for issue in get_my_issues(user)}
+    elif user.jira_keys:
+        since_minutes = math.ceil((now - snapshot.last_sync) / 60) + SYNC_OVERLAP_MINUTES
+        changed_keys = [
+            issue.key
+            for issue in search_all_issues(user, get_changed_issues_jql(user, since_minutes), fields='status',
+                                           expand=None)
+        ]
+        if changed_keys:
+            # changed issues that no longer match the daily filter are dropped from the snapshot
+            relevant_issues = search_all_issues(
+                user, f'{get_my_issues_jql(user)} and key in ({", ".join(changed_keys)})'
+            )
+            for key in changed_keys:
+                snapshot.issues.pop(key, None)
+            snapshot.issues.update({issue.key: issue.raw for issue in relevant_issues})
+
+    snapshot.jira_keys = list(user.jira_keys or [])
+    snapshot.jira_host = jira_host
+    snapshot.last_sync = now
+    return snapshot.save_in_db()
+
+
+def get_user_issues(user: User, max_staleness: Optional[float] = None) -> List[Issue]:
+    if not user.jira_keys:
+        return []
+    max_staleness = max_staleness if max_staleness is not None else float(
+        os.environ.get(ISSUE_SNAPSHOT_MAX_STALENESS, DEFAULT_ISSUE_SNAPSHOT_MAX_STALENESS)
+    )
+    snapshot = IssueSnapshot.get_from_db(user.slack_data.user_id)
+    if not (snapshot and snapshot.last_sync and snapshot.jira_keys == user.jira_keys
+            and time.time() - snapshot.last_sync <= max_staleness):
+        snapshot = sync_user_issues(user)
+    # the daily modal pages through the issues, so their order must not change with the order of the syncs
+    return [issue_from_raw(user, snapshot.issues[key]) for key in sorted(snapshot.issues, key=get_issue_order)]
+
+
+def get_snapshot_statuses(user: User, issue_keys: List[str]) -> Dict[str, str]:
+    """The statuses of the issues as last synced, without syncing. Issues removed from the snapshot are left out"""
+    snapshot = IssueSnapshot.get_from_db(user.slack_data.user_id)
+    issues = snapshot.issues if snapshot else {}
+    return {key: issues[key]['fields']['status']['name'] for key in issue_keys if key in issues}
+
+
+def sync_all_users():
+    users = [user for user in get_users() if user.jira_keys]
+    if not users:
+        return
+
+    def sync(user: User):
+        try:
+            sync_user_issues(user)
+        except Exception as e:
+            logger.error(f"Error syncing issues of {user.slack_data.user_id}: {e}")
+
+    with ThreadPoolExecutor(max_workers=min(get_max_workers(), len(users))) as executor:
+        list(executor.map(sync, users))
+
+
+def _prefetch_users_issues(credential_user: User, users_by_account: Dict[str, User]) -> Dict[str, IssueSnapshot]:
+    projects = sorted({key for user in users_by_account.values() for key in user.jira_keys})
+    account_ids = ", ".join(f'"{account_id}"' for account_id in users_by_account)
+    jql = (f'assignee in ({account_ids}) '
+           f'and project in ({", ".join(projects)}) and {get_excluded_status_categories_jql()}')
+    issues = search_all_issues(credential_user, jql, fields=f'{MY_ISSUES_FIELDS},assignee', expand=None)
+
+    issues_by_user: Dict[str, Dict[str, dict]] = defaultdict(dict)
+    for issue in issues:
+        user = users_by_account.get(get_issue_assignee_id(issue))
+        if user and issue.raw['fields']['project']['key'] in user.jira_keys:
+            issues_by_user[user.slack_data.user_id][issue.key] = issue.raw
+
+    now = time.time()
+    snapshots: Dict[str, IssueSnapshot] = {}
+    for user in users_by_account.values():
+        user_id = user.slack_data.user_id
+        snapshots[user_id] = IssueSnapshot(
+            user_id=user_id,
+            issues=issues_by_user[user_id],
+            jira_keys=list(user.jira_keys),
+            last_sync=now,
+            jira_host=get_jira_host(user.jira_server_url)
+        ).save_in_db()
+    return snapshots
+
+
+def prefetch_team_issues(team: str) -> Dict[str, IssueSnapshot]:
+    users = sorted((user for user in User.get_team_users(team) if user.jira_keys),
+                   key=lambda user: user.jira_server_url)
+    snapshots: Dict[str, IssueSnapshot] = {}
+    for _, server_users in groupby(users, key=lambda user: user.jira_server_url):
+        users_by_account: Dict[str, User] = {}
+        for user in server_users:
+            try:
+                users_by_account[get_jira_account_id(user)] = user
+            except Exception as e:
+                logger.error(f"Error resolving jira account of {user.slack_data.user_id}: {e}")
+
+        # a credential only sees its own projects, so it runs the query for the members whose projects it has,
+        # starting from the member with the most projects
+        remaining = sorted(users_by_account.items(), key=lambda item: len(set(item[1].jira_keys)), reverse=True)
+        while remaining:
+            credential_user = remaining[0][1]
+            credential_projects = set(credential_user.jira_keys)
+            covered = {account_id: user for account_id, user in remaining
+                       if set(user.jira_keys) <= credential_projects}
+            remaining = [(account_id, user) for account_id, user in remaining if account_id not in covered]
+            snapshots.update(_prefetch_users_issues(credential_user, covered))
+    return snapshots
+
+
+def prefetch_all_teams():
+    for team in Team.get_all_teams_from_db():
+        started = time.monotonic()
+        try:
+            snapshots = prefetch_team_issues(team.name)
+        except Exception as e:
+            logger.error(f"Error prefetching issues of team {team.name}: {e}")
+            continue
+        logger.info(f"Prefetched issues of {len(snapshots)} users of team {team.name} "
+                    f"in {time.monotonic() - started:.2f}s")
+
+
+class IssueSyncWorker(Thread):
+    def __init__(self, interval: Optional[float] = None):
+        super().__init__(name="issue-sync-worker", daemon=True)
+        self.interval = interval or float(os.environ.get(ISSUE_SYNC_INTERVAL, DEFAULT_ISSUE_SYNC_INTERVAL))
+        self.prefetch_time = os.environ.get(TEAM_PREFETCH_TIME)
+        self._last_prefetch: Optional[date] = None
+        self._stop_event = Event()
+
+    def _should_prefetch(self) -> bool:
+        if not self.prefetch_time:
+            return False
+        now = datetime.now()
+        return self._last_prefetch != now.date() and now.strftime("%H:%M") >= self.prefetch_time
+
+    def run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                if self._should_prefetch():
+                    self._last_prefetch = date.today()
+                    prefetch_all_teams()
+                sync_all_users()
+            except Exception as e:
+                logger.error(f"Error running issue sync cycle: {e}")
+            logger.info(f"Issue sync cycle took {time.monotonic() - started:.2f}s")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_issue_sync_worker(interval: Optional[float] = None) -> IssueSyncWorker:
+    worker = IssueSyncWorker(interval)
+    worker.start()
+    return worker
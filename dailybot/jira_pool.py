@@ -0,0 +1,158 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Dict, Tuple
+from urllib.parse import urlparse
+
+from jira import JIRA
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dailybot.constants import JiraHostType
+from dailybot.metrics import increment
+
+JIRA_POOL_MAX_CLIENTS = "JIRA_POOL_MAX_CLIENTS"
+JIRA_POOL_IDLE_TIMEOUT = "JIRA_POOL_IDLE_TIMEOUT"
+JIRA_POOL_CONNECTIONS = "JIRA_POOL_CONNECTIONS"
+JIRA_REQUEST_TIMEOUT = "JIRA_REQUEST_TIMEOUT"
+JIRA_MAX_RETRIES = "JIRA_MAX_RETRIES"
+JIRA_BACKOFF_FACTOR = "JIRA_BACKOFF_FACTOR"
+
+TOO_MANY_REQUESTS = 429
+RETRY_STATUS_CODES = (TOO_MANY_REQUESTS, 500, 502, 503, 504)
+
+
+def record_response(host: str, status_code: int):
+    increment(f"jira.{host}.requests")
+    if status_code == TOO_MANY_REQUESTS:
+        increment(f"jira.{host}.throttled")
+    elif status_code >= 500:
+        increment(f"jira.{host}.errors")
+
+
+class JiraRetry(Retry):
+    """Retries idempotent requests, and POSTs only when Jira throttled them, since it answers 429 before processing
+    the request while a 5xx or a read timeout may come after a transition was applied"""
+
+    def __init__(self, *args, on_response: Callable[[int], None] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_response = on_response
+
+    def new(self, **kwargs) -> "JiraRetry":
+        retry = super().new(**kwargs)
+        retry.on_response = self.on_response
+        return retry
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "POST":
+            # POST is left out of allowed_methods, so read errors of a POST are never retried
+            return status_code == TOO_MANY_REQUESTS and super().is_retry("GET", status_code, has_retry_after)
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, *args, **kwargs) -> "JiraRetry":
+        retry = super().increment(method, url, response, *args, **kwargs)
+        # responses that are retried never reach the session's response hooks, the last one does
+        if response is not None and self.on_response:
+            self.on_response(response.status)
+        return retry
+
+
+@dataclass
+class JiraPoolConfig:
+    max_clients: int = int(os.environ.get(JIRA_POOL_MAX_CLIENTS, 256))
+    idle_timeout: float = float(os.environ.get(JIRA_POOL_IDLE_TIMEOUT, 30 * 60))
+    connections_per_host: int = int(os.environ.get(JIRA_POOL_CONNECTIONS, 10))
+    request_timeout: float = float(os.environ.get(JIRA_REQUEST_TIMEOUT, 10))
+    max_retries: int = int(os.environ.get(JIRA_MAX_RETRIES, 5))
+    backoff_factor: float = float(os.environ.get(JIRA_BACKOFF_FACTOR, 0.5))
+
+
+class JiraClientPool:
+    def __init__(self, config: JiraPoolConfig = None):
+        self.config = config or JiraPoolConfig()
+        self._clients: "OrderedDict[Tuple[str, str, str, str], Tuple[float, JIRA]]" = OrderedDict()
+        self._adapters: Dict[str, HTTPAdapter] = {}  # host: adapter shared by the clients of every user of the host
+        self._lock = Lock()
+
+    def _get_adapter(self, host: str) -> HTTPAdapter:
+        adapter = self._adapters.get(host)
+        if adapter is None:
+            retry = JiraRetry(
+                total=self.config.max_retries,
+                backoff_factor=self.config.backoff_factor,
+                status_forcelist=RETRY_STATUS_CODES,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+                on_response=lambda status_code: record_response(host, status_code)
+            )
+            # blocking makes connections_per_host a limit, past it requests wait for a free connection
+            adapter = self._adapters[host] = HTTPAdapter(
+                pool_maxsize=self.config.connections_per_host,
+                pool_block=True,
+                max_retries=retry
+            )
+        return adapter
+
+    @staticmethod
+    def _record_final_response(host: str):
+        def hook(response, *args, **kwargs):
+            record_response(host, response.status_code)
+            return response
+        return hook
+
+    @staticmethod
+    def _close_client(client: JIRA):
+        # the host's adapter is shared with the other clients and is closed by close()
+        client._session.adapters.clear()
+        client.close()
+
+    def _create_client(self, jira_server_url: str, jira_email: str, jira_api_token: str,
+                       jira_host_type: str) -> JIRA:
+        options = dict(timeout=self.config.request_timeout, max_retries=0, get_server_info=False)
+        if jira_host_type == JiraHostType.Local.name:
+            client = JIRA(jira_server_url, token_auth=jira_api_token, **options)
+        elif jira_host_type == JiraHostType.Cloud.name:
+            client = JIRA(jira_server_url, basic_auth=(jira_email, jira_api_token), **options)
+        else:
+            raise Exception  # todo: handle
+
+        host = urlparse(jira_server_url).netloc
+        adapter = self._get_adapter(host)
+        client._session.mount("https://", adapter)
+        client._session.mount("http://", adapter)
+        client._session.hooks["response"].append(self._record_final_response(host))
+        return client
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            key, (last_used, client) = next(iter(self._clients.items()))
+            if len(self._clients) <= self.config.max_clients and now - last_used < self.config.idle_timeout:
+                break
+            self._clients.pop(key)
+            self._close_client(client)
+
+    def get(self, jira_server_url: str, jira_email: str, jira_api_token: str, jira_host_type: str) -> JIRA:
+        key = (jira_server_url, jira_email, jira_api_token, jira_host_type)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.pop(key, None)
+            self._evict_idle(now)
+            client = entry[1] if entry else None
+            if client is None:
+                client = self._create_client(*key)
+            self._clients[key] = (now, client)
+            return client
+
+    def close(self):
+        with self._lock:
+            for _, client in self._clients.values():
+                self._close_client(client)
+            self._clients.clear()
+            for adapter in self._adapters.values():
+                adapter.close()
+            self._adapters.clear()
+
+
+jira_client_pool = JiraClientPool()
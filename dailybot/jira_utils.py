@@ -1,103 +1,272 @@
-from functools import lru_cache
-from typing import List
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Dict
+from urllib.parse import urlparse
 
 from jira import JIRA, Issue, Project, JIRAError
 
-from dailybot.constants import JiraHostType
-from dailybot.mongodb import User, Daily
+from dailybot.cache import TTLCache
+from dailybot.constants import EXCLUDED_STATUS_CATEGORIES, MAX_LEN_SLACK_SELECTOR
+from dailybot.jira_pool import jira_client_pool
+from dailybot.mongodb import User, Daily, DailyIssueReport
+
+JIRA_MAX_WORKERS = "JIRA_MAX_WORKERS"
+DEFAULT_JIRA_MAX_WORKERS = 8
+ISSUES_CHUNK_SIZE = 100
+MY_ISSUES_FIELDS = 'summary,status,project,issuetype'
+TRANSITIONS_CACHE_TTL = "TRANSITIONS_CACHE_TTL"
+TRANSITIONS_CACHE_MAX_SIZE = "TRANSITIONS_CACHE_MAX_SIZE"
+
+transitions_cache = TTLCache(
+    max_size=int(os.environ.get(TRANSITIONS_CACHE_MAX_SIZE, 4096)),
+    ttl=float(os.environ.get(TRANSITIONS_CACHE_TTL, 300))
+)
+WORKFLOW_CACHE_TTL = "WORKFLOW_CACHE_TTL"
+PROJECTS_CACHE_TTL = "PROJECTS_CACHE_TTL"
+
+# shared by every user of the same jira server
+workflow_statuses_cache = TTLCache(max_size=1024, ttl=float(os.environ.get(WORKFLOW_CACHE_TTL, 60 * 60)))
+account_ids_cache = TTLCache(max_size=4096, ttl=24 * 60 * 60)
+projects_cache = TTLCache(max_size=64, ttl=float(os.environ.get(PROJECTS_CACHE_TTL, 60 * 60)))
+
+
+@dataclass
+class IssueUpdateResult:
+    key: str
+    success: bool
+    elapsed: float
+    transition: Optional[str] = None
+    error: Optional[str] = None
+
+
+def get_max_workers() -> int:
+    return int(os.environ.get(JIRA_MAX_WORKERS, DEFAULT_JIRA_MAX_WORKERS))
 
 
-@lru_cache
 def get_jira(jira_server_url: str, jira_email: str, jira_api_token: str, jira_host_type: str) -> JIRA:
-    if jira_host_type == JiraHostType.Local.name:
-        return JIRA(jira_server_url, token_auth=jira_api_token)
-    if jira_host_type == JiraHostType.Cloud.name:
-        return JIRA(jira_server_url, basic_auth=(jira_email, jira_api_token))
-    raise Exception  # todo: handle
+    return jira_client_pool.get(
+        jira_server_url=jira_server_url,
+        jira_email=jira_email,
+        jira_api_token=jira_api_token,
+        jira_host_type=jira_host_type
+    )
 
 
 def get_jira_projects(user: User) -> List[Project]:
-    try:
+    def fetch_projects():
         jira_client = get_jira(
             jira_server_url=user.jira_server_url,
             jira_email=user.jira_email,
             jira_api_token=user.jira_api_token,
             jira_host_type=user.jira_host_type
         )
-        return jira_client.projects()
+        return sorted(jira_client.projects(), key=lambda project: project.key)
+
+    try:
+        return projects_cache.get_or_set(user.jira_server_url.rstrip('/'), fetch_projects)
     except JIRAError:
         return []
 
 
-@lru_cache
-def get_optional_transitions(jira_server_url: str, jira_email: str, jira_api_token: str, jira_host_type: str,
-                             issue_key: str):
-    jira_client = get_jira(
-        jira_server_url=jira_server_url,
-        jira_email=jira_email,
-        jira_api_token=jira_api_token,
-        jira_host_type=jira_host_type
+def filter_projects(projects: List[Project], prefix: str, limit: int = MAX_LEN_SLACK_SELECTOR) -> List[Project]:
+    prefix = prefix.strip().lower()
+    return [
+        project for project in projects
+        if project.key.lower().startswith(prefix) or project.name.lower().startswith(prefix)
+    ][:limit]
+
+
+def search_jira_projects(user: User, prefix: str, limit: int = MAX_LEN_SLACK_SELECTOR) -> List[Project]:
+    return filter_projects(get_jira_projects(user), prefix, limit)
+
+
+def transitions_cache_key(user: User, issue_key: str) -> tuple:
+    return user.jira_server_url, user.jira_email, user.jira_api_token, user.jira_host_type, issue_key
+
+
+def get_optional_transitions(user: User, issue_key: str) -> List[dict]:
+    def fetch_transitions():
+        jira_client = get_jira(
+            jira_server_url=user.jira_server_url,
+            jira_email=user.jira_email,
+            jira_api_token=user.jira_api_token,
+            jira_host_type=user.jira_host_type
+        )
+        return jira_client.transitions(issue_key)
+
+    return transitions_cache.get_or_set(transitions_cache_key(user, issue_key), fetch_transitions)
+
+
+def invalidate_optional_transitions(user: User, issue_key: str):
+    transitions_cache.invalidate(transitions_cache_key(user, issue_key))
+
+
+def get_jira_host(jira_server_url: str) -> str:
+    return urlparse(jira_server_url).netloc
+
+
+def invalidate_issue_transitions(jira_server_url: str, issue_key: str) -> int:
+    server_host = get_jira_host(jira_server_url)
+    return transitions_cache.invalidate_matching(
+        lambda key: key[-1] == issue_key and get_jira_host(key[0]) == server_host
     )
-    return jira_client.transitions(issue_key)
 
 
 def get_optional_statuses(user: User, issue_key: str):
-    transitions = get_optional_transitions(
-        jira_server_url=user.jira_server_url,
-        jira_email=user.jira_email,
-        jira_api_token=user.jira_api_token,
-        jira_host_type=user.jira_host_type,
-        issue_key=issue_key
-    )
+    transitions = get_optional_transitions(user=user, issue_key=issue_key)
+    return get_statuses_from_transitions(transitions)
+
+
+def get_statuses_from_transitions(transitions: List[dict]) -> List[str]:
     return list(set(transition['to']['name'] for transition in transitions if transition.get('isAvailable', True)))
 
 
-def get_my_issues(user: User) -> List[Issue]:
-    issues: List[Issue] = []
-    i = 0
-    chunk_size = 100
-    jira_client = get_jira(
+def get_preloaded_statuses(issue: Issue) -> Optional[List[str]]:
+    transitions = issue.raw.get('transitions')
+    if transitions is None:
+        return None
+    return get_statuses_from_transitions(transitions)
+
+
+def get_user_jira(user: User) -> JIRA:
+    return get_jira(
         jira_server_url=user.jira_server_url,
         jira_email=user.jira_email,
         jira_api_token=user.jira_api_token,
         jira_host_type=user.jira_host_type
     )
-    # TODO: SUOER IMPORTANT : think about how to understand what status to filter, not all the same in each board!
-    while user.jira_keys:  # if user has no jira keys don't enter
-        chunk = jira_client.search_issues(
-            f'assignee = currentUser() and project in ({", ".join(user.jira_keys)}) and status not in (DONE, "TO DO", Closed)',
-            startAt=i, maxResults=chunk_size)
-        i += chunk_size
-        issues += chunk.iterable
-        if i >= chunk.total:
-            break
-    return issues
 
 
-def get_issue(user: User, issue_key: str) -> Issue:
-    jira_client = get_jira(
-        jira_server_url=user.jira_server_url,
-        jira_email=user.jira_email,
-        jira_api_token=user.jira_api_token,
-        jira_host_type=user.jira_host_type
+def get_jira_account_id(user: User) -> str:
+    def fetch_account_id():
+        myself = get_user_jira(user).myself()
+        return myself.get('accountId') or myself['name']  # jira server has no account ids
+
+    return account_ids_cache.get_or_set(
+        (user.jira_server_url, user.jira_email, user.jira_api_token, user.jira_host_type),
+        fetch_account_id
     )
-    return jira_client.issue(issue_key)
 
 
-def get_transition_name(user: User, issue_key: str, to_status: str):
-    optional_transitions = get_optional_transitions(
-        jira_server_url=user.jira_server_url,
-        jira_email=user.jira_email,
-        jira_api_token=user.jira_api_token,
-        jira_host_type=user.jira_host_type,
-        issue_key=issue_key
+def get_issue_assignee_id(issue: Issue) -> Optional[str]:
+    assignee = issue.raw.get('fields', {}).get('assignee')
+    if assignee:
+        return assignee.get('accountId') or assignee.get('name')
+
+
+def get_excluded_status_categories_jql() -> str:
+    excluded_categories = ", ".join(EXCLUDED_STATUS_CATEGORIES)
+    return f'statusCategory not in ({excluded_categories})'
+
+
+def get_my_issues_jql(user: User) -> str:
+    return (f'assignee = currentUser() and project in ({", ".join(user.jira_keys)}) '
+            f'and {get_excluded_status_categories_jql()}')
+
+
+def get_project_statuses(user: User, project_key: str) -> Dict[str, List[str]]:
+    def fetch_project_statuses():
+        jira_client = get_user_jira(user)
+        return {
+            issue_type['name']: [status['name'] for status in issue_type['statuses']]
+            for issue_type in jira_client._get_json(f'project/{project_key}/statuses')
+        }
+
+    return workflow_statuses_cache.get_or_set(
+        (user.jira_server_url.rstrip('/'), project_key),
+        fetch_project_statuses
     )
+
+
+def get_workflow_statuses(user: User, issue: Issue) -> Optional[List[str]]:
+    fields = issue.raw.get('fields', {})
+    project, issue_type = fields.get('project'), fields.get('issuetype')
+    if not (project and issue_type):
+        return None
+    try:
+        return get_project_statuses(user, project['key']).get(issue_type['name'])
+    except JIRAError:
+        return None
+
+
+def search_all_issues(user: User, jql: str, fields: Optional[str] = MY_ISSUES_FIELDS,
+                      expand: Optional[str] = 'transitions', validate_query: bool = True) -> List[Issue]:
+    jira_client = get_user_jira(user)
+
+    def fetch_chunk(start_at: int):
+        return jira_client.search_issues(jql, startAt=start_at, maxResults=ISSUES_CHUNK_SIZE, fields=fields,
+                                         expand=expand, validate_query=validate_query)
+
+    first_chunk = fetch_chunk(0)
+    issues: List[Issue] = list(first_chunk)
+    remaining_starts = list(range(ISSUES_CHUNK_SIZE, first_chunk.total, ISSUES_CHUNK_SIZE))
+    if remaining_starts:
+        with ThreadPoolExecutor(max_workers=min(get_max_workers(), len(remaining_starts))) as executor:
+            for chunk in executor.map(fetch_chunk, remaining_starts):
+                issues += chunk
+
+    for issue in issues:
+        if 'transitions' in issue.raw:
+            transitions_cache.set(transitions_cache_key(user, issue.key), issue.raw['transitions'])
+    return issues
+
+
+def get_my_issues(user: User, fields: Optional[str] = MY_ISSUES_FIELDS) -> List[Issue]:
+    if not user.jira_keys:  # if user has no jira keys don't search
+        return []
+    return search_all_issues(user, get_my_issues_jql(user), fields=fields)
+
+
+def issue_from_raw(user: User, raw: dict) -> Issue:
+    jira_client = get_user_jira(user)
+    return Issue(jira_client._options, jira_client._session, raw=raw)
+
+
+def get_issue_browse_link(jira_server_url: str, issue_key: str) -> str:
+    return f"{jira_server_url.rstrip('/')}/browse/{issue_key}"
+
+
+def get_transition_name(user: User, issue_key: str, to_status: str):
+    optional_transitions = get_optional_transitions(user=user, issue_key=issue_key)
     for transition in optional_transitions:
         if transition['to']['name'] == to_status:
             return transition['name']
 
 
-def update_daily_report_status_and_enrich_status(user: User, daily: Daily, logger):
+def get_issues_by_keys(user: User, issue_keys: List[str], fields: str = 'summary,status') -> List[Issue]:
+    if not issue_keys:
+        return []
+    # without validation a deleted or hidden issue is left out of the results instead of failing the whole search
+    return search_all_issues(user, f'key in ({", ".join(issue_keys)})', fields=fields, expand=None,
+                             validate_query=False)
+
+
+def transition_issue_to_status(user: User, jira_client: JIRA, issue: DailyIssueReport,
+                               current_status: Optional[str] = None) -> IssueUpdateResult:
+    start = time.perf_counter()
+    transition = None
+    try:
+        transition = get_transition_name(user, issue_key=issue.key, to_status=issue.status)
+        if transition:
+            jira_client.transition_issue(issue.key, transition=transition)
+            invalidate_optional_transitions(user, issue.key)
+        elif issue.status and issue.status != current_status:
+            return IssueUpdateResult(key=issue.key, success=False, elapsed=time.perf_counter() - start,
+                                     error=f"No transition from `{current_status}` to `{issue.status}`")
+    except JIRAError as e:
+        return IssueUpdateResult(key=issue.key, success=False, elapsed=time.perf_counter() - start,
+                                 transition=transition, error=e.text)
+    except Exception as e:
+        return IssueUpdateResult(key=issue.key, success=False, elapsed=time.perf_counter() - start,
+                                 transition=transition, error=str(e))
+    return IssueUpdateResult(key=issue.key, success=True, elapsed=time.perf_counter() - start,
+                             transition=transition)
+
+
+def update_daily_report_status_and_enrich_status(user: User, daily: Daily, logger,
+                                                 max_workers: Optional[int] = None) -> List[IssueUpdateResult]:
     jira_client = get_jira(
         jira_server_url=user.jira_server_url,
         jira_email=user.jira_email,
@@ -105,14 +274,34 @@ def update_daily_report_status_and_enrich_status(user: User, daily: Daily, logge
         jira_host_type=user.jira_host_type
     )
     daily_report = daily.reports[user.slack_data.user_id]
-    for issue in daily_report.issue_reports:
-        jira_issue = jira_client.issue(issue.key)
-        issue.link = jira_issue.permalink()
-        issue.summary = jira_issue.get_field('summary')
-        transition = get_transition_name(user, issue_key=issue.key, to_status=issue.status)
-        if transition:
-            try:
-                jira_client.transition_issue(issue.key, transition=transition)
-            except JIRAError:
-                # should handle unsuccessful update and remove update from daily
-                logger.info(f"could not move issue {issue.key} to `{issue.status}` status")
+    issue_reports = daily_report.issue_reports
+    if not issue_reports:
+        return []
+
+    jira_issues = {
+        jira_issue.key: jira_issue
+        for jira_issue in get_issues_by_keys(user, [issue.key for issue in issue_reports])
+    }
+    current_statuses: Dict[str, str] = {}
+    for issue in issue_reports:
+        jira_issue = jira_issues.get(issue.key)
+        if jira_issue:
+            issue.link = jira_issue.permalink()
+            issue.summary = jira_issue.get_field('summary')
+            current_statuses[issue.key] = jira_issue.get_field('status').name
+        else:
+            # deleted or no longer visible to the user, the report keeps the link it was saved with
+            issue.link = issue.link or get_issue_browse_link(user.jira_server_url, issue.key)
+
+    max_workers = max_workers or get_max_workers()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(issue_reports))) as executor:
+        results = list(executor.map(
+            lambda issue: transition_issue_to_status(user, jira_client, issue, current_statuses.get(issue.key)),
+            issue_reports
+        ))
+
+    for issue, result in zip(issue_reports, results):
+        if not result.success:
+            # should handle unsuccessful update and remove update from daily
+            logger.info(f"could not move issue {issue.key} to `{issue.status}` status")
+    return results
@@ -0,0 +1,97 @@
+import hmac
+import json
+import logging
+import os
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+from dailybot.jira_utils import invalidate_issue_transitions, get_jira_host
+from dailybot.mongodb import IssueSnapshot
+
+JIRA_WEBHOOK_PORT = "JIRA_WEBHOOK_PORT"
+JIRA_WEBHOOK_SECRET = "JIRA_WEBHOOK_SECRET"
+JIRA_WEBHOOK_PATH = "/jira/events"
+
+ISSUE_DELETED_EVENT = "jira:issue_deleted"
+SNAPSHOT_FIELDS = ("summary", "status")
+
+logger = logging.getLogger(__name__)
+
+
+def handle_jira_webhook(payload: dict):
+    issue = payload.get("issue")
+    if not issue:
+        return
+    issue_key = issue["key"]
+    server_url = issue["self"]  # the issue's rest url, on the server that sent the event
+    jira_host = get_jira_host(server_url)
+
+    invalidate_issue_transitions(server_url, issue_key)
+    if payload.get("webhookEvent") == ISSUE_DELETED_EVENT:
+        IssueSnapshot.remove_issue(issue_key, jira_host)
+        return
+
+    fields = {name: value for name, value in issue.get("fields", {}).items() if name in SNAPSHOT_FIELDS}
+    IssueSnapshot.update_issue_fields(issue_key, jira_host, fields)
+
+
+def is_authorized(query: str, secret: Optional[str]) -> bool:
+    # without a secret anyone could rewrite the snapshots, so the webhook is never served without one
+    if not secret:
+        return False
+    # compare_digest only accepts ascii str, a secret with other characters is compared as bytes
+    return hmac.compare_digest(parse_qs(query).get("secret", [""])[0].encode(), secret.encode())
+
+
+class JiraWebhookHandler(BaseHTTPRequestHandler):
+    secret = None
+
+    def _respond(self, status: HTTPStatus):
+        self.send_response(status)
+        self.end_headers()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != JIRA_WEBHOOK_PATH:
+            return self._respond(HTTPStatus.NOT_FOUND)
+        if not is_authorized(url.query, self.secret):
+            return self._respond(HTTPStatus.UNAUTHORIZED)
+
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            return self._respond(HTTPStatus.BAD_REQUEST)
+
+        try:
+            handle_jira_webhook(payload)
+        except KeyError as e:
+            logger.info(f"Jira webhook without {e}")
+            return self._respond(HTTPStatus.BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error handling jira webhook: {e}")
+            return self._respond(HTTPStatus.INTERNAL_SERVER_ERROR)
+        self._respond(HTTPStatus.NO_CONTENT)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def create_jira_webhook_server(port: int, secret: str = None) -> ThreadingHTTPServer:
+    handler = type("ConfiguredJiraWebhookHandler", (JiraWebhookHandler,), {"secret": secret})
+    return ThreadingHTTPServer(("", port), handler)
+
+
+def start_jira_webhook_server():
+    port = os.environ.get(JIRA_WEBHOOK_PORT)
+    if not port:
+        return None
+    secret = os.environ.get(JIRA_WEBHOOK_SECRET)
+    if not secret:
+        logger.error(f"Not starting the jira webhook server, {JIRA_WEBHOOK_SECRET} is not set")
+        return None
+    server = create_jira_webhook_server(int(port), secret)
+    Thread(target=server.serve_forever, name="jira-webhook-server", daemon=True).start()
+    return server
@@ -0,0 +1,192 @@
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from threading import Thread, Event
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from dailybot.codec import slotted, decode, encode
+from dailybot.metrics import increment, set_gauge, record_timing
+from dailybot.mongodb import get_collection, JOBS_COLLECTION_NAME
+
+JOB_WORKERS = "JOB_WORKERS"
+JOB_POLL_INTERVAL = "JOB_POLL_INTERVAL"
+DEFAULT_JOB_WORKERS = 4
+DEFAULT_JOB_POLL_INTERVAL = 1.0
+JOB_LEASE_SECONDS = 5 * 60
+JOB_BACKOFF_SECONDS = 5
+QUEUE_DEPTH_METRIC = "jobs.queue_depth"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[dict], Optional[dict]]
+_handlers: Dict[str, JobHandler] = {}
+
+
+@slotted
+@dataclass
+class Job:
+    kind: str
+    payload: dict
+    status: str = PENDING
+    attempts: int = 0
+    max_attempts: int = 5
+    run_after: float = field(default_factory=time.time)
+    locked_until: Optional[float] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    dedupe_key: Optional[str] = None  # at most one pending job per key
+    _id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+def job_handler(kind: str):
+    def register(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        return handler
+    return register
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = 5, delay: float = 0,
+            dedupe_key: Optional[str] = None) -> Job:
+    job = Job(kind=kind, payload=payload, max_attempts=max_attempts, run_after=time.time() + delay,
+              dedupe_key=dedupe_key)
+    try:
+        get_collection(JOBS_COLLECTION_NAME).insert_one(encode(job))
+    except DuplicateKeyError:
+        # a pending job with the same key will do the work, so this one is debounced into it
+        increment(f"jobs.{kind}.deduped")
+        return job
+    increment(f"jobs.{kind}.enqueued")
+    return job
+
+
+def ensure_job_indexes():
+    jobs_collection = get_collection(JOBS_COLLECTION_NAME)
+    jobs_collection.create_index([("status", ASCENDING), ("run_after", ASCENDING)])
+    jobs_collection.create_index(
+        "dedupe_key",
+        unique=True,
+        partialFilterExpression={"dedupe_key": {"$type": "string"}, "status": PENDING}
+    )
+
+
+def get_queue_depth() -> int:
+    return get_collection(JOBS_COLLECTION_NAME).count_documents({"status": {"$in": [PENDING, RUNNING]}})
+
+
+def claim_job() -> Optional[Job]:
+    now = time.time()
+    job: dict = get_collection(JOBS_COLLECTION_NAME).find_one_and_update(
+        {"$or": [
+            {"status": PENDING, "run_after": {"$lte": now}},
+            {"status": RUNNING, "locked_until": {"$lt": now}},  # the worker holding it died
+        ]},
+        {"$set": {"status": RUNNING, "locked_until": now + JOB_LEASE_SECONDS}, "$inc": {"attempts": 1}},
+        sort=[("run_after", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+    if job:
+        return decode(Job, job)
+
+
+def _finish_job(job: Job, update: dict):
+    get_collection(JOBS_COLLECTION_NAME).update_one({"_id": job._id}, {"$set": update})
+
+
+def run_job(job: Job):
+    started = time.perf_counter()
+    handler = _handlers.get(job.kind)
+    try:
+        if not handler:
+            raise LookupError(f"No handler registered for job kind {job.kind}")
+        result = handler(job.payload)
+    except Exception as e:
+        increment(f"jobs.{job.kind}.errors")
+        if job.attempts >= job.max_attempts:
+            logger.error(f"Job {job._id} ({job.kind}) failed after {job.attempts} attempts: {e}")
+            _finish_job(job, {"status": FAILED, "error": str(e), "finished_at": time.time()})
+        else:
+            logger.info(f"Job {job._id} ({job.kind}) failed, retrying: {e}")
+            try:
+                _finish_job(job, {
+                    "status": PENDING,
+                    "error": str(e),
+                    "run_after": time.time() + JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+                })
+            except DuplicateKeyError:
+                # a newer job with the same key is already pending and will redo the work
+                _finish_job(job, {"status": FAILED, "error": str(e), "finished_at": time.time()})
+        return
+
+    _finish_job(job, {"status": DONE, "result": result, "error": None, "finished_at": time.time()})
+    increment(f"jobs.{job.kind}.done")
+    record_timing(f"jobs.{job.kind}.duration", time.perf_counter() - started)
+
+
+class JobWorker(Thread):
+    def __init__(self, name: str, stop_event: Event, poll_interval: float):
+        super().__init__(name=name, daemon=True)
+        self._stop_event = stop_event
+        self.poll_interval = poll_interval
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                job = claim_job()
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}")
+                job = None
+            if job:
+                try:
+                    run_job(job)
+                except Exception as e:
+                    # the job stays running until its lease expires, then another worker claims it again
+                    logger.error(f"Error finishing job {job._id} ({job.kind}): {e}")
+            else:
+                self._stop_event.wait(self.poll_interval)
+
+
+class JobWorkerPool:
+    def __init__(self, workers: Optional[int] = None, poll_interval: Optional[float] = None):
+        self.workers = workers or int(os.environ.get(JOB_WORKERS, DEFAULT_JOB_WORKERS))
+        self.poll_interval = poll_interval or float(os.environ.get(JOB_POLL_INTERVAL, DEFAULT_JOB_POLL_INTERVAL))
+        self._stop_event = Event()
+        self._threads: List[Thread] = []
+
+    def _report_queue_depth(self):
+        while not self._stop_event.is_set():
+            try:
+                set_gauge(QUEUE_DEPTH_METRIC, get_queue_depth())
+            except Exception as e:
+                logger.error(f"Error reading job queue depth: {e}")
+            self._stop_event.wait(10 * self.poll_interval)
+
+    def start(self) -> "JobWorkerPool":
+        ensure_job_indexes()
+        self._threads = [
+            JobWorker(f"job-worker-{i}", self._stop_event, self.poll_interval) for i in range(self.workers)
+        ]
+        self._threads.append(Thread(target=self._report_queue_depth, name="job-queue-depth", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def start_job_workers(workers: Optional[int] = None) -> JobWorkerPool:
+    return JobWorkerPool(workers).start()
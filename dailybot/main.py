@@ -1,37 +1,95 @@
 import os
-from typing import Tuple, List, Optional, Dict
+import time
+from typing import Optional
 
 from slack_bolt import App
+from slack_sdk.errors import SlackApiError
 
-from dailybot.block_utils import (generate_daily_modal, generate_home_tab_view, generate_user_from_config_action,
+from dailybot.analytics import start_analytics_worker, get_stuck_issues, get_status_dwell_times, get_submission_rates
+from dailybot.block_utils import (generate_home_tab_view, generate_user_from_config_action,
                                   generate_home_tab_view_set_jira_keys, generate_home_tab_view_user_configured,
-                                  generate_user_not_exists_modal, generate_daily_message)
-from dailybot.constants import (DAILY_MODAL_SUBMISSION, ACTIONS_ISSUE_DAILY_FORM, ISSUE_LINK_ACTION,
-                                ISSUE_SUMMERY_ACTION, GENERAL_COMMENTS_ACTION, BULK_ID_SEPERATOR,
-                                SAVE_USER_CONFIGURATIONS, SELECT_USER_BOARD, SELECT_USER_TEAM, DAILY_MODAL, SHOW_DAILY,
-                                ADD_TEAM, SAVE_USER_BOARD, TYPE_OR_SELECT_USER_BOARD, TYPE_USER_BOARD,
-                                IGNORE_ISSUE_IN_DAILY_FORM, SELECT_STATUS_ISSUE_DAILY_FORM)
-from dailybot.jira_utils import get_my_issues, update_daily_report_status_and_enrich_status
-from dailybot.mongodb import Team, User, Daily, DailyIssueReport, DailyReport
+                                  generate_user_not_exists_modal,
+                                  generate_jira_projects_options, generate_loading_modal, generate_daily_error_modal,
+                                  parse_daily_view_state, get_empty_daily_errors, generate_team_analytics_message)
+from dailybot.constants import (DAILY_MODAL_SUBMISSION, ISSUE_LINK_ACTION, ISSUE_SUMMERY_ACTION,
+                                GENERAL_COMMENTS_ACTION, SAVE_USER_CONFIGURATIONS, SELECT_USER_BOARD, SELECT_USER_TEAM,
+                                DAILY_MODAL, SHOW_DAILY, ADD_TEAM,
+                                IGNORE_ISSUE_IN_DAILY_FORM, SELECT_STATUS_ISSUE_DAILY_FORM,
+                                DAILY_MODAL_FIRST_VIEW_METRIC, DAILY_MODAL_FULL_VIEW_METRIC,
+                                DAILY_MODAL_NEXT_PAGE, DAILY_MODAL_PREVIOUS_PAGE, SHOW_ANALYTICS)
+from dailybot.daily_jobs import enqueue_daily_submission, start_daily_job_workers
+from dailybot.daily_publisher import start_daily_publisher, post_daily
+from dailybot.handler_utils import (render_daily_modal, is_paginated, get_submitted_report, get_selected_jira_keys,
+                                    get_home_tab_to_publish, parse_add_team_command, get_added_team_message,
+                                    parse_analytics_command)
+from dailybot.issue_sync import start_issue_sync_worker
+from dailybot.jira_utils import search_jira_projects
+from dailybot.jira_webhook import start_jira_webhook_server
+from dailybot.metrics import record_timing
+from dailybot.mongodb import Team, User, Daily, DailyDraft, ensure_daily_indexes
+from dailybot.slack_dispatcher import SlackDispatcher, DispatchingClient, INTERACTIVE, BACKGROUND, BULK
+from dailybot.user_cache import start_user_cache_invalidator
 
 app = App(
     token=os.environ.get("SLACK_BOT_TOKEN"),
     signing_secret=os.environ.get("SLACK_SIGNING_SECRET")
 )
+slack_dispatcher = SlackDispatcher(app.client)
+interactive_client = slack_dispatcher.with_priority(INTERACTIVE)
+background_client = slack_dispatcher.with_priority(BACKGROUND)
 
 
 @app.shortcut(DAILY_MODAL)
-def daily_report(ack, body, client):
+def daily_report(ack, body, logger):
+    started = time.perf_counter()
+    ack()
+    loading_view = interactive_client.views_open(
+        trigger_id=body["trigger_id"],
+        view=generate_loading_modal()
+    )["view"]
+    record_timing(DAILY_MODAL_FIRST_VIEW_METRIC, time.perf_counter() - started)
+
     user_id = body['user']['id']
-    user = User.get_from_db(user_id)
-    daily = Daily.get_from_db(user.team)
+    try:
+        user = User.get_from_db(user_id)
+        if user:
+            daily = Daily.get_from_db(user.team)
+            draft = DailyDraft.get_from_db(user_id)
+            view = render_daily_modal(user, daily, draft)
+        else:
+            view = generate_user_not_exists_modal()
+    except Exception as e:
+        # otherwise the user is left with the loading modal
+        logger.error(f"Error building daily modal of {user_id}: {e}")
+        view = generate_daily_error_modal()
+
+    try:
+        interactive_client.views_update(view_id=loading_view["id"], hash=loading_view["hash"], view=view)
+    except SlackApiError as e:
+        logger.error(f"Error updating daily modal: {e}")
+        return
+    record_timing(DAILY_MODAL_FULL_VIEW_METRIC, time.perf_counter() - started)
 
-    client.views_open(
-        trigger_id=body["trigger_id"],
-        view=(generate_daily_modal(user=user, issues=get_my_issues(user), daily=daily)
-              if user else generate_user_not_exists_modal())
-    )
+
+@app.action(DAILY_MODAL_NEXT_PAGE)
+@app.action(DAILY_MODAL_PREVIOUS_PAGE)
+def change_daily_modal_page(ack, body, logger):
     ack()
+    view = body['view']
+    user = User.get_from_db(body['user']['id'])
+    if not user:
+        logger.error(f"Daily modal page change of unknown user {body['user']['id']}")
+        return
+    # answers of the current page are kept in a draft, since slack only holds the state of the visible blocks
+    draft = DailyDraft.get_from_db(user.slack_data.user_id)
+    draft.update_page(*parse_daily_view_state(view))
+    draft.save_in_db()
+
+    new_view = render_daily_modal(user, Daily.get_from_db(user.team), draft, page=int(body['actions'][0]['value']))
+    try:
+        interactive_client.views_update(view_id=view['id'], hash=view['hash'], view=new_view)
+    except SlackApiError as e:
+        logger.error(f"Error changing daily modal page: {e}")
 
 
 @app.action(IGNORE_ISSUE_IN_DAILY_FORM)
@@ -60,118 +118,69 @@ def general_comments_action(ack, body, logger):
     pass
 
 
-def get_details_from_view(view: dict) -> Tuple[List[DailyIssueReport], Optional[str]]:
-    general_comments = None
-    ignore = []
-    issues: Dict[str, DailyIssueReport] = {}
-    for key, value in view['state']['values'].items():
-        if key == GENERAL_COMMENTS_ACTION:
-            general_comments = value[key]['value']
-        else:
-            issue_key, action = key.split(BULK_ID_SEPERATOR)
-            issue_report = issues.get(issue_key, DailyIssueReport(key=issue_key))
-            if action == ISSUE_SUMMERY_ACTION:
-                issue_report.details = value[action]['value']
-            if action == ACTIONS_ISSUE_DAILY_FORM:
-                issue_report.status = value[SELECT_STATUS_ISSUE_DAILY_FORM]['selected_option']['value']
-                selected_options = value[IGNORE_ISSUE_IN_DAILY_FORM]['selected_options']
-                if selected_options and selected_options[0]['value'] == 'ignore-issue':
-                    ignore.append(issue_key)
-
-            issues[issue_key] = issue_report
-
-    for issue_to_ignore in ignore:
-        issues.pop(issue_to_ignore)
-
-    return list(issues.values()), general_comments
-
-
 @app.view(DAILY_MODAL_SUBMISSION)
 def handle_daily_submission(ack, body, view, logger):
     user = User.get_from_db(body['user']['id'])
-    issue_reports, general_comments = get_details_from_view(view)
-    if not (issue_reports or general_comments):
-        return  # TODO: should show error that we didnt get anything to report
-    daily = Daily.get_from_db(user.team)
-    daily.reports[user.slack_data.user_id] = DailyReport(
-        issue_reports=issue_reports,
-        general_comments=general_comments
-    )
+    draft = DailyDraft.get_from_db(user.slack_data.user_id) if is_paginated(view) else None
+    report = get_submitted_report(user, view, draft)
+    if not report:
+        ack(response_action="errors", errors=get_empty_daily_errors(view))
+        return
+    daily = Daily(team=user.team)
+    daily.save_report(user.slack_data.user_id, report)
+    if draft:
+        draft.delete_from_db()
+    # Jira enrichment and transitions run on the job workers
+    enqueue_daily_submission(user, daily)
     ack()
 
-    # Update Jira:
-    update_daily_report_status_and_enrich_status(user=user, daily=daily, logger=logger)
-    daily.save_in_db()
+
+def publish_home_tab(client: DispatchingClient, user_id: str, view: dict, published_view: Optional[dict] = None):
+    view = get_home_tab_to_publish(view, published_view)
+    if view:
+        client.views_publish(user_id=user_id, view=view)
 
 
 @app.event("app_home_opened")
-def update_home_tab(client, event, logger):
+def update_home_tab(event, logger):
     user_id = event['user']
     user = User.get_from_db(user_id)
 
     if not user:
-        try:
-            # views.publish is the method that your app uses to push a view to the Home tab
-            client.views_publish(
-                user_id=event["user"],
-                view=generate_home_tab_view(teams=Team.get_all_teams_from_db())
-            )
-
-        except Exception as e:
-            logger.error(f"Error publishing home tab: {e}")
-        return
+        view = generate_home_tab_view(teams=Team.get_all_teams_cached())
+    elif not user.jira_keys:
+        view = generate_home_tab_view_set_jira_keys(user)
+    else:
+        view = generate_home_tab_view_user_configured()
 
-    if not user.jira_keys:
-        app.client.views_publish(
-            user_id=user.slack_data.user_id,
-            view=generate_home_tab_view_set_jira_keys(user)
-        )
-        return
-
-    app.client.views_publish(
-        user_id=user.slack_data.user_id,
-        view=generate_home_tab_view_user_configured()
-    )
+    try:
+        # views.publish is the method that your app uses to push a view to the Home tab
+        publish_home_tab(background_client, user_id, view, published_view=event.get('view'))
+    except Exception as e:
+        logger.error(f"Error publishing home tab: {e}")
 
 
 @app.action(SAVE_USER_CONFIGURATIONS)
-def save_user_config_action(ack, body, client):
+def save_user_config_action(ack, body):
     user = generate_user_from_config_action(body).save_in_db()
-    client.views_publish(
-        user_id=user.slack_data.user_id,
-        view=generate_home_tab_view_set_jira_keys(user)
-    )
+    publish_home_tab(interactive_client, user.slack_data.user_id, generate_home_tab_view_set_jira_keys(user))
     ack()
 
 @app.action(SELECT_USER_BOARD)
 def select_user_board_action(ack, body):
     user = User.get_from_db(body['user']['id'])
-    jira_keys = [
-        option['value']
-        for option in body['view']['state']['values'][TYPE_OR_SELECT_USER_BOARD][SELECT_USER_BOARD]['selected_options']
-    ]
-    user.update_jira_keys(jira_keys)
+    user.update_jira_keys(get_selected_jira_keys(body))
 
-    app.client.views_publish(
-        user_id=user.slack_data.user_id,
-        view=generate_home_tab_view_user_configured()
-    )
+    publish_home_tab(interactive_client, user.slack_data.user_id, generate_home_tab_view_user_configured())
 
     ack()
 
 
-@app.action(SAVE_USER_BOARD)
-def select_user_board_action(ack, body):
+@app.options(SELECT_USER_BOARD)
+def search_user_board_options(ack, body):
     user = User.get_from_db(body['user']['id'])
-    jira_keys = body['view']['state']['values'][TYPE_OR_SELECT_USER_BOARD][TYPE_USER_BOARD]['value'].split(',')
-    user.update_jira_keys(jira_keys)
-
-    app.client.views_publish(
-        user_id=user.slack_data.user_id,
-        view=generate_home_tab_view_user_configured()
-    )
-
-    ack()
+    projects = search_jira_projects(user, body.get('value', '')) if user else []
+    ack(generate_jira_projects_options(projects))
 
 
 @app.action(SELECT_USER_TEAM)
@@ -181,28 +190,53 @@ def select_user_team_action(ack, body, logger):
 
 
 @app.command(SHOW_DAILY)
-def show_daily(ack, command, client):
+def show_daily(ack, command):
+    # slack expects the ack within 3 seconds, posting a big daily takes longer
+    ack()
     with_gui = 'gui' in command.get('text', '')
     user = User.get_from_db(command['user_id'])
     daily = Daily.get_from_db(user.team)
-    blocks = generate_daily_message(user, daily, with_gui=with_gui)
-    client.chat_postMessage(
-        channel=command['channel_id'],
-        text="Daily Report",
-        blocks=blocks
-    )
+    post_daily(interactive_client, command['channel_id'], daily, with_gui=with_gui)
+
+
+@app.command(SHOW_ANALYTICS)
+def show_analytics(ack, respond, command):
     ack()
+    user = User.get_from_db(command['user_id'])
+    if not user:
+        respond("Please configure your team in the app's home tab first")
+        return
+    min_days, user_id = parse_analytics_command(user, command.get('text', ''))
+    for blocks in generate_team_analytics_message(
+            team=user.team,
+            min_days=min_days,
+            stuck_issues=get_stuck_issues(user.team, min_days, user_id),
+            dwell_times=get_status_dwell_times(user.team, user_id),
+            submission_rates=get_submission_rates(user.team, user_id)
+    ):
+        respond(text="Daily analytics", blocks=blocks)
 
 
 @app.command(ADD_TEAM)
 def add_team(ack, respond, command):
     ack()
-    name, daily_channel = command['text'].split()
-    Team(name, daily_channel).save_in_db()
-    respond(f"Added team {name} with daily channel {daily_channel}")
+    try:
+        team = parse_add_team_command(command['text'])
+    except ValueError as e:
+        respond(str(e))
+        return
+    team.save_in_db()
+    respond(get_added_team_message(team))
 
 
 def run():
+    ensure_daily_indexes()
+    start_user_cache_invalidator()
+    start_issue_sync_worker()
+    start_jira_webhook_server()
+    start_daily_job_workers(slack_dispatcher)
+    start_daily_publisher(slack_dispatcher.with_priority(BULK))
+    start_analytics_worker()
     app.start(port=int(os.environ.get("PORT", 3000)))
 
 
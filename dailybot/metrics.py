@@ -0,0 +1,62 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict
+
+
+@dataclass
+class TimingStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+_lock = Lock()
+_timings: Dict[str, TimingStats] = defaultdict(TimingStats)
+_counters: Dict[str, int] = defaultdict(int)
+_gauges: Dict[str, float] = {}
+
+
+def record_timing(name: str, seconds: float):
+    with _lock:
+        stats = _timings[name]
+        stats.count += 1
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+
+
+def increment(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+
+def get_timings() -> Dict[str, TimingStats]:
+    with _lock:
+        return {name: TimingStats(stats.count, stats.total, stats.max) for name, stats in _timings.items()}
+
+
+def get_counters() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters)
+
+
+def get_gauges() -> Dict[str, float]:
+    with _lock:
+        return dict(_gauges)
+
+
+def format_metrics() -> str:
+    """One `name value` line per counter, gauge and timing statistic, sorted by name"""
+    lines = [f"{name} {value}" for name, value in {**get_counters(), **get_gauges()}.items()]
+    for name, stats in get_timings().items():
+        lines += [f"{name}.count {stats.count}", f"{name}.average {stats.average:.6f}", f"{name}.max {stats.max:.6f}"]
+    return "\n".join(sorted(lines)) + "\n"
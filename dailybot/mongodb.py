@@ -1,19 +1,23 @@
 import os
+import time
 from datetime import date
 
-from dacite import from_dict
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field
 from functools import lru_cache
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, Iterator
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
 
+from dailybot.cache import TTLCache
+from dailybot.codec import slotted, decode, encode
 from dailybot.constants import JiraHostType
 
 MONGODB_USERNAME = "MONGODB_USERNAME"
 MONGODB_PASSWORD = "MONGODB_PASSWORD"
 CLUSTER_NAME = "CLUSTER_NAME"
 MONGODB_DATABASE = "MONGODB_DATABASE"
+MONGODB_URI = "MONGODB_URI"  # overrides the atlas cluster, e.g. a local mongo for development
 
 
 DAILY_DB = 'daily'
@@ -21,28 +25,64 @@ REPORTS_DB = 'reports'
 USERS_COLLECTION_NAME = 'users'
 TEAMS_COLLECTION_NAME = 'teams'
 DAILIES_COLLECTION_NAME = 'dailys'
-
-
+ISSUE_SNAPSHOTS_COLLECTION_NAME = 'issue_snapshots'
+JOBS_COLLECTION_NAME = 'jobs'
+DAILY_DRAFTS_COLLECTION_NAME = 'daily_drafts'
+ANALYTICS_COLLECTION_NAME = 'daily_analytics'
+DAILY_HISTORY_BATCH_SIZE = 50
+USERS_CACHE_TTL = "USERS_CACHE_TTL"
+USERS_CACHE_MAX_SIZE = "USERS_CACHE_MAX_SIZE"
+TEAMS_CACHE_TTL = "TEAMS_CACHE_TTL"
+
+# other processes only see new teams once the ttl expires
+teams_cache = TTLCache(max_size=1, ttl=float(os.environ.get(TEAMS_CACHE_TTL, 5 * 60)))
+# cached users are shared between requests and must not be mutated, other processes are invalidated by
+# dailybot.user_cache
+users_cache = TTLCache(max_size=int(os.environ.get(USERS_CACHE_MAX_SIZE, 1024)),
+                       ttl=float(os.environ.get(USERS_CACHE_TTL, 10 * 60)))
+
+
+@slotted
 @dataclass
 class DailyIssueReport:
     key: str
-    status: Optional[str] = field(init=False)
-    details: Optional[str] = field(init=False)
-    link: Optional[str] = field(init=False)
-    summary: Optional[str] = field(init=False)
+    status: Optional[str] = field(init=False, default=None)
+    details: Optional[str] = field(init=False, default=None)
+    link: Optional[str] = field(init=False, default=None)
+    summary: Optional[str] = field(init=False, default=None)
 
 
+@slotted
 @dataclass
 class DailyReport:
     issue_reports: List[DailyIssueReport]
     general_comments: Optional[str]
+    version: int = 0  # incremented on every write of the report
+
+
+@slotted
+@dataclass
+class PostedMessage:
+    ts: str
+    fingerprint: str  # of the blocks it was last posted or updated with
 
 
+@slotted
+@dataclass
+class PostedDaily:
+    channel: str
+    # the first message is in the channel and the rest are replies in its thread
+    messages: List[PostedMessage] = field(default_factory=list)
+    with_gui: bool = False
+
+
+@slotted
 @dataclass
 class Daily:
     team: str
     reports: Dict[str, DailyReport] = field(default_factory=dict)  # user_id: DailyReport
     date: Optional[str] = None
+    posted: Dict[str, PostedDaily] = field(default_factory=dict)  # channel: PostedDaily
     _id: Optional[str] = None
 
     @staticmethod
@@ -59,20 +99,115 @@ class Daily:
 
     def save_in_db(self):
         dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
-        dailies_collection.replace_one({"_id": self.formatted_id}, asdict(self), upsert=True)
+        dailies_collection.replace_one({"_id": self.formatted_id}, encode(self), upsert=True)
+
+    def report_write(self, user_id: str, report: DailyReport,
+                     expected_version: Optional[int] = None) -> Tuple[dict, List[dict], bool]:
+        """Returns the filter, update pipeline and upsert flag that write a single user's report and increment its
+        version. With expected_version the write only applies if the stored report still has that version,
+        0 meaning there is no stored report yet."""
+        query = {"_id": self.formatted_id}
+        if expected_version:
+            query[f"reports.{user_id}.version"] = expected_version
+        elif expected_version == 0:
+            query[f"reports.{user_id}"] = {"$exists": False}
+        report_path = f"reports.{user_id}"
+        update = [{"$set": {
+            report_path: {"$mergeObjects": [
+                {"$literal": encode(report)},  # user text must not be read as expressions
+                {"version": {"$add": [{"$ifNull": [f"${report_path}.version", 0]}, 1]}}
+            ]},
+            "team": self.team,
+            "date": self.date,
+            "posted": {"$ifNull": ["$posted", {}]}
+        }}]
+        # a report with a version implies the daily exists, a failed match is then a conflict and not a new daily
+        return query, update, not expected_version
+
+    def save_report(self, user_id: str, report: DailyReport, expected_version: Optional[int] = None) -> bool:
+        """Writes only reports.<user_id>, so teammates submitting at the same time don't overwrite each other.
+        Returns False if expected_version is given and the stored report was changed meanwhile."""
+        dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
+        query, update, upsert = self.report_write(user_id, report, expected_version)
+        try:
+            daily = dailies_collection.find_one_and_update(query, update, upsert=upsert,
+                                                           projection={f"reports.{user_id}.version": 1},
+                                                           return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:  # the daily exists but the report didn't match expected_version
+            daily = None
+        if not daily:
+            return False
+        report.version = daily["reports"][user_id]["version"]
+        self.reports[user_id] = report
+        return True
+
+    def set_posted(self, posted_daily: PostedDaily):
+        self.posted[posted_daily.channel] = posted_daily
+        dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
+        # only the posted message is written, so reports submitted meanwhile are kept
+        dailies_collection.update_one(
+            {"_id": self.formatted_id},
+            {
+                "$set": {f"posted.{posted_daily.channel}": encode(posted_daily)},
+                "$setOnInsert": {"team": self.team, "date": self.date, "reports": {}}
+            },
+            upsert=True
+        )
 
     @classmethod
     def get_from_db(cls, team: str, daily_date: Optional[str] = None) -> "Daily":
         daily_date = daily_date or str(date.today())
         dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
         daily: dict = dailies_collection.find_one({"_id": cls._format_id(daily_date, team)})
-        return from_dict(cls, daily) if daily else cls(team=team, date=daily_date)
+        return decode(cls, daily) if daily else cls(team=team, date=daily_date)
+
+    @classmethod
+    def get_many_from_db(cls, teams: List[str], daily_date: Optional[str] = None) -> Dict[str, "Daily"]:
+        daily_date = daily_date or str(date.today())
+        dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
+        dailies = {
+            daily['team']: decode(cls, daily)
+            for daily in dailies_collection.find({"_id": {"$in": [cls._format_id(daily_date, team) for team in teams]}})
+        }
+        return {team: dailies.get(team) or cls(team=team, date=daily_date) for team in teams}
 
+    @staticmethod
+    def history_query(team: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      user_id: Optional[str] = None) -> Tuple[dict, dict]:
+        """Returns the filter and projection of the dailies between the dates (inclusive), by team and/or user.
+        With a user only its report is read, without the teammates' reports or the posted messages."""
+        query = {}
+        if team:
+            query["team"] = team
+        if start_date or end_date:
+            query["date"] = {
+                **({"$gte": start_date} if start_date else {}),
+                **({"$lte": end_date} if end_date else {})
+            }
+        if user_id:
+            query[f"reports.{user_id}"] = {"$exists": True}
+        projection = {"team": 1, "date": 1, f"reports.{user_id}" if user_id else "reports": 1}
+        return query, projection
 
+    @classmethod
+    def iter_history(cls, team: Optional[str] = None, start_date: Optional[str] = None,
+                     end_date: Optional[str] = None, user_id: Optional[str] = None,
+                     batch_size: int = DAILY_HISTORY_BATCH_SIZE) -> Iterator["Daily"]:
+        """Streams the dailies by date, so weeks of history are never held in memory at once"""
+        dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
+        query, projection = cls.history_query(team, start_date, end_date, user_id)
+        with dailies_collection.find(query, projection, sort=[("date", ASCENDING)], batch_size=batch_size) as cursor:
+            for daily in cursor:
+                yield decode(cls, daily)
+
+
+@slotted
 @dataclass
 class Team:
     name: str
     daily_channel: str
+    publish_time: Optional[str] = None  # local HH:MM to post the daily in daily_channel
+    last_published_date: Optional[str] = None
     _id: Optional[str] = None
 
     def __post_init__(self):
@@ -80,21 +215,43 @@ class Team:
 
     def save_in_db(self):
         teams_collection = get_collection(TEAMS_COLLECTION_NAME)
-        teams_collection.replace_one({"_id": self._id}, asdict(self), upsert=True)
+        teams_collection.replace_one({"_id": self._id}, encode(self), upsert=True)
+        teams_cache.clear()
 
     @classmethod
     def get_from_db(cls, team) -> "Team":
         teams_collection = get_collection(TEAMS_COLLECTION_NAME)
         team: dict = teams_collection.find_one({"_id": team})
         if team:
-            return from_dict(cls, team)
+            return decode(cls, team)
+
+    def claim_publish(self, daily_date: str) -> bool:
+        teams_collection = get_collection(TEAMS_COLLECTION_NAME)
+        result = teams_collection.update_one(
+            {"_id": self._id, "last_published_date": {"$ne": daily_date}},
+            {"$set": {"last_published_date": daily_date}}
+        )
+        return result.modified_count == 1
+
+    def release_publish(self, daily_date: str):
+        """Undoes claim_publish after the daily could not be posted"""
+        teams_collection = get_collection(TEAMS_COLLECTION_NAME)
+        teams_collection.update_one(
+            {"_id": self._id, "last_published_date": daily_date},
+            {"$set": {"last_published_date": self.last_published_date}}
+        )
 
     @classmethod
     def get_all_teams_from_db(cls) -> List["Team"]:
         teams_collection = get_collection(TEAMS_COLLECTION_NAME)
-        return [from_dict(cls, team) for team in teams_collection.find({})]
+        return [decode(cls, team) for team in teams_collection.find({})]
+
+    @classmethod
+    def get_all_teams_cached(cls) -> List["Team"]:
+        return teams_cache.get_or_set(TEAMS_COLLECTION_NAME, cls.get_all_teams_from_db)
 
 
+@slotted
 @dataclass
 class SlackUserData:
     team_id: str
@@ -103,6 +260,7 @@ class SlackUserData:
     user_name: str
 
 
+@slotted
 @dataclass
 class User:
     team: str
@@ -112,6 +270,7 @@ class User:
     slack_data: SlackUserData
     jira_keys: Optional[List[str]] = field(default_factory=list)
     jira_host_type: str = JiraHostType.Cloud.name
+    updated_at: Optional[float] = None  # unix timestamp, lets other processes poll for changed users
     _id: Optional[str] = None
 
     def __post_init__(self):
@@ -119,23 +278,130 @@ class User:
 
     def save_in_db(self):
         users_collection = get_collection(USERS_COLLECTION_NAME)
-        users_collection.replace_one({"_id": self._id}, asdict(self), upsert=True)
+        self.updated_at = time.time()
+        users_collection.replace_one({"_id": self._id}, encode(self), upsert=True)
+        users_cache.invalidate(self._id)
         return self
 
     def update_jira_keys(self, jira_keys):
         users_collection = get_collection(USERS_COLLECTION_NAME)
-        users_collection.update_one({"_id": self._id}, {"$set": {"jira_keys": jira_keys}})
+        self.updated_at = time.time()
+        users_collection.update_one(
+            {"_id": self._id},
+            {"$set": {"jira_keys": jira_keys, "updated_at": self.updated_at}}
+        )
+        users_cache.invalidate(self._id)
         return self
 
     @classmethod
     def get_from_db(cls, user_id: str) -> Optional["User"]:
+        user = users_cache.get(user_id)
+        if user:
+            return user
         users_collection = get_collection(USERS_COLLECTION_NAME)
         user: dict = users_collection.find_one({"_id": user_id})
         if user:
-            return from_dict(cls, user)
+            # unregistered users are not cached, they are expected to register soon
+            user = decode(cls, user)
+            users_cache.set(user_id, user)
+            return user
+
+    @classmethod
+    def get_team_users(cls, team: str) -> List["User"]:
+        users_collection = get_collection(USERS_COLLECTION_NAME)
+        return [decode(cls, user) for user in users_collection.find({"team": team})]
+
+
+@slotted
+@dataclass
+class IssueSnapshot:
+    user_id: str
+    issues: Dict[str, dict] = field(default_factory=dict)  # issue key: raw jira issue
+    jira_keys: List[str] = field(default_factory=list)
+    last_sync: Optional[float] = None  # unix timestamp
+    jira_host: Optional[str] = None  # issue keys are only unique within a jira server
+    _id: Optional[str] = None
+
+    def __post_init__(self):
+        self._id = self.user_id
+
+    def save_in_db(self):
+        snapshots_collection = get_collection(ISSUE_SNAPSHOTS_COLLECTION_NAME)
+        snapshots_collection.replace_one({"_id": self._id}, encode(self), upsert=True)
+        return self
+
+    @classmethod
+    def get_from_db(cls, user_id: str) -> Optional["IssueSnapshot"]:
+        snapshots_collection = get_collection(ISSUE_SNAPSHOTS_COLLECTION_NAME)
+        snapshot: dict = snapshots_collection.find_one({"_id": user_id})
+        if snapshot:
+            return decode(cls, snapshot)
+
+    @staticmethod
+    def update_issue_fields(issue_key: str, jira_host: str, fields: dict):
+        snapshots_collection = get_collection(ISSUE_SNAPSHOTS_COLLECTION_NAME)
+        snapshots_collection.update_many(
+            {"jira_host": jira_host, f"issues.{issue_key}": {"$exists": True}},
+            {
+                "$set": {f"issues.{issue_key}.fields.{name}": value for name, value in fields.items()},
+                "$unset": {f"issues.{issue_key}.transitions": ""}  # transitions depend on the status
+            }
+        )
+
+    @staticmethod
+    def remove_issue(issue_key: str, jira_host: str):
+        snapshots_collection = get_collection(ISSUE_SNAPSHOTS_COLLECTION_NAME)
+        snapshots_collection.update_many(
+            {"jira_host": jira_host, f"issues.{issue_key}": {"$exists": True}},
+            {"$unset": {f"issues.{issue_key}": ""}}
+        )
+
+
+@slotted
+@dataclass
+class DailyDraft:
+    """Answers of a paginated daily modal, kept between page switches until it is submitted"""
+    user_id: str
+    issue_reports: Dict[str, DailyIssueReport] = field(default_factory=dict)  # issue key: DailyIssueReport
+    ignored_keys: List[str] = field(default_factory=list)
+    general_comments: Optional[str] = None
+    date: Optional[str] = None
+    _id: Optional[str] = None
+
+    @staticmethod
+    def _format_id(daily_date, user_id):
+        return f"{daily_date}|{user_id}"
+
+    def __post_init__(self):
+        self.date = self.date or str(date.today())
+        self._id = self._format_id(self.date, self.user_id)
+
+    def update_page(self, page_reports: Dict[str, DailyIssueReport], ignored_keys: List[str],
+                    general_comments: Optional[str] = None):
+        self.issue_reports.update(page_reports)
+        self.ignored_keys = [key for key in self.ignored_keys if key not in page_reports] + ignored_keys
+        if general_comments is not None:
+            self.general_comments = general_comments
+
+    def save_in_db(self):
+        drafts_collection = get_collection(DAILY_DRAFTS_COLLECTION_NAME)
+        drafts_collection.replace_one({"_id": self._id}, encode(self), upsert=True)
+
+    def delete_from_db(self):
+        drafts_collection = get_collection(DAILY_DRAFTS_COLLECTION_NAME)
+        drafts_collection.delete_one({"_id": self._id})
+
+    @classmethod
+    def get_from_db(cls, user_id: str, daily_date: Optional[str] = None) -> "DailyDraft":
+        daily_date = daily_date or str(date.today())
+        drafts_collection = get_collection(DAILY_DRAFTS_COLLECTION_NAME)
+        draft: dict = drafts_collection.find_one({"_id": cls._format_id(daily_date, user_id)})
+        return decode(cls, draft) if draft else cls(user_id=user_id, date=daily_date)
 
 
 def get_database():
+    if os.environ.get(MONGODB_URI):
+        return MongoClient(os.environ[MONGODB_URI])
     username = os.environ.get(MONGODB_USERNAME)
     password = os.environ.get(MONGODB_PASSWORD)
     cluster_name = os.environ.get(CLUSTER_NAME)
@@ -155,6 +421,13 @@ def get_collection(collection_name: str):
     return get_daily_reports_database()[collection_name]
 
 
+def ensure_daily_indexes():
+    dailies_collection = get_collection(DAILIES_COLLECTION_NAME)
+    # a team's history, and the date index for a user's history or all teams over a date range
+    dailies_collection.create_index([("team", ASCENDING), ("date", ASCENDING)])
+    dailies_collection.create_index([("date", ASCENDING)])
+
+
 def get_users() -> List[User]:
     users_collection = get_collection(USERS_COLLECTION_NAME)
-    return [from_dict(User, user) for user in users_collection.find({})]
+    return [decode(User, user) for user in users_collection.find({})]
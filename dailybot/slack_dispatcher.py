@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import partial
+from queue import PriorityQueue, Empty
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+from dailybot.metrics import increment, record_timing, set_gauge
+
+SLACK_DISPATCHER_WORKERS = "SLACK_DISPATCHER_WORKERS"
+DEFAULT_SLACK_DISPATCHER_WORKERS = 4
+
+INTERACTIVE = 0  # views answering a user action
+BACKGROUND = 1  # home tab refreshes and other non blocking updates
+BULK = 2  # scheduled posts
+
+# requests per minute of slack's rate limit tiers, limited per method, https://api.slack.com/docs/rate-limits
+TIER_RATES = {1: 1, 2: 20, 3: 50, 4: 100}
+METHOD_TIERS = {
+    "views_open": 4,
+    "views_update": 4,
+    "views_push": 4,
+    "views_publish": 4,
+    "chat_postMessage": 4,  # actually limited to about one message per second per channel
+    "chat_update": 3,
+    "chat_delete": 3,
+    "conversations_replies": 3,
+}
+DEFAULT_TIER = 3
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or max(1.0, rate_per_minute / 10)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = Lock()
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available and returns 0, otherwise returns the seconds until one is"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+
+@dataclass(order=True)
+class _SlackCall:
+    priority: int
+    sequence: int
+    method: str = field(compare=False)
+    kwargs: dict = field(compare=False)
+    future: Future = field(compare=False, default_factory=Future)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    started: bool = field(compare=False, default=False)
+
+
+class SlackDispatcher:
+    def __init__(self, client: WebClient, workers: Optional[int] = None):
+        self.client = client
+        self.workers = workers or int(os.environ.get(SLACK_DISPATCHER_WORKERS, DEFAULT_SLACK_DISPATCHER_WORKERS))
+        self._queue: "PriorityQueue[_SlackCall]" = PriorityQueue()
+        self._sequence = itertools.count()
+        self._buckets: Dict[str, TokenBucket] = {}
+        # calls whose method is out of tokens wait here instead of holding a worker, (due time, sequence, call)
+        self._deferred: List[Tuple[float, int, _SlackCall]] = []
+        self._pending_publishes: Dict[str, _SlackCall] = {}
+        self._lock = Lock()
+        self._threads: List[Thread] = []
+        self._pid = None
+
+    def _ensure_started(self):
+        # threads don't survive a fork, so every process starts its own workers
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                Thread(target=self._work, name=f"slack-dispatcher-{i}", daemon=True) for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, method: str, priority: int = INTERACTIVE, **kwargs) -> Future:
+        self._ensure_started()
+        with self._lock:
+            if method == "views_publish":
+                pending = self._pending_publishes.get(kwargs["user_id"])
+                if pending and not pending.started:
+                    # only the latest home tab matters, the queued publish sends it instead
+                    pending.kwargs = kwargs
+                    increment("slack_dispatcher.coalesced")
+                    return pending.future
+            call = _SlackCall(priority=priority, sequence=next(self._sequence), method=method, kwargs=kwargs)
+            if method == "views_publish":
+                self._pending_publishes[kwargs["user_id"]] = call
+        self._queue.put(call)
+        set_gauge("slack_dispatcher.queue_depth", self._queue.qsize())
+        return call.future
+
+    def call(self, method: str, priority: int = INTERACTIVE, **kwargs) -> SlackResponse:
+        return self.submit(method, priority, **kwargs).result()
+
+    def with_priority(self, priority: int) -> "DispatchingClient":
+        return DispatchingClient(self, priority)
+
+    def _get_bucket(self, method: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                bucket = self._buckets[method] = TokenBucket(TIER_RATES[METHOD_TIERS.get(method, DEFAULT_TIER)])
+            return bucket
+
+    def _defer(self, call: _SlackCall, seconds: float):
+        with self._lock:
+            heapq.heappush(self._deferred, (time.monotonic() + seconds, call.sequence, call))
+
+    def _next_call(self) -> _SlackCall:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._deferred and self._deferred[0][0] <= now:
+                    self._queue.put(heapq.heappop(self._deferred)[2])
+                timeout = self._deferred[0][0] - now if self._deferred else None
+            try:
+                return self._queue.get(timeout=timeout)
+            except Empty:
+                continue
+
+    def _work(self):
+        while True:
+            call = self._next_call()
+            bucket = self._get_bucket(call.method)
+            wait = bucket.try_acquire()
+            if wait:
+                # waiting for the token here would hold back the higher priority calls queued behind this one
+                self._defer(call, wait)
+                continue
+
+            with self._lock:
+                call.started = True
+                if call.method == "views_publish" and self._pending_publishes.get(call.kwargs["user_id"]) is call:
+                    del self._pending_publishes[call.kwargs["user_id"]]
+            record_timing(f"slack_dispatcher.queue_latency.{call.priority}", time.monotonic() - call.enqueued_at)
+            try:
+                call.future.set_result(getattr(self.client, call.method)(**call.kwargs))
+            except SlackApiError as e:
+                if e.response.status_code == 429:
+                    retry_after = float(e.response.headers.get("Retry-After", 1))
+                    logger.info(f"Slack throttled {call.method}, retrying in {retry_after}s")
+                    increment(f"slack_dispatcher.throttled.{call.method}")
+                    bucket.pause(retry_after)
+                    self._queue.put(call)
+                else:
+                    call.future.set_exception(e)
+            except Exception as e:
+                call.future.set_exception(e)
+
+
+class DispatchingClient:
+    def __init__(self, dispatcher: SlackDispatcher, priority: int):
+        self._dispatcher = dispatcher
+        self._priority = priority
+
+    def __getattr__(self, method: str):
+        return partial(self._dispatcher.call, method, self._priority)
@@ -0,0 +1,92 @@
+import logging
+import os
+import time
+from threading import Thread, Event
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from dailybot.metrics import set_gauge
+from dailybot.mongodb import get_collection, users_cache, USERS_COLLECTION_NAME
+
+USERS_CACHE_POLL_INTERVAL = "USERS_CACHE_POLL_INTERVAL"
+DEFAULT_USERS_CACHE_POLL_INTERVAL = 30
+USERS_CACHE_HIT_RATE_METRIC = "users_cache.hit_rate"
+USERS_CACHE_SIZE_METRIC = "users_cache.size"
+CHANGE_STREAM_MAX_AWAIT_MS = 1000
+CHANGE_STREAM_RETRY_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def report_users_cache_stats():
+    stats = users_cache.stats()
+    set_gauge(USERS_CACHE_HIT_RATE_METRIC, stats.hit_rate)
+    set_gauge(USERS_CACHE_SIZE_METRIC, stats.size)
+
+
+class UserCacheInvalidator(Thread):
+    """Drops users changed by other processes from users_cache, through a change stream on the users collection.
+    Deployments without change streams (a standalone mongod) fall back to polling the users' updated_at."""
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        super().__init__(name="user-cache-invalidator", daemon=True)
+        self.poll_interval = poll_interval or float(
+            os.environ.get(USERS_CACHE_POLL_INTERVAL, DEFAULT_USERS_CACHE_POLL_INTERVAL)
+        )
+        self._stop_event = Event()
+        self._last_poll = time.time()
+        self._last_report = 0.0
+
+    def _report_stats(self):
+        if time.monotonic() - self._last_report >= self.poll_interval:
+            report_users_cache_stats()
+            self._last_report = time.monotonic()
+
+    def _watch(self):
+        users_collection = get_collection(USERS_COLLECTION_NAME)
+        with users_collection.watch(max_await_time_ms=CHANGE_STREAM_MAX_AWAIT_MS) as stream:
+            while not self._stop_event.is_set() and stream.alive:
+                change = stream.try_next()
+                if change:
+                    users_cache.invalidate(change["documentKey"]["_id"])
+                self._report_stats()
+
+    def _poll(self):
+        users_collection = get_collection(USERS_COLLECTION_NAME)
+        while not self._stop_event.is_set():
+            # clocks of other processes may be a little behind, so polls overlap by one interval
+            since, self._last_poll = self._last_poll - self.poll_interval, time.time()
+            for user in users_collection.find({"updated_at": {"$gt": since}}, {"_id": 1}):
+                users_cache.invalidate(user["_id"])
+            self._report_stats()
+            self._stop_event.wait(self.poll_interval)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._watch()
+            except OperationFailure as e:
+                logger.info(f"Users change stream is unavailable, polling for changes instead: {e}")
+                break
+            except PyMongoError as e:
+                logger.error(f"Users change stream failed, retrying: {e}")
+                # changes may have been missed while the stream was down
+                users_cache.clear()
+                self._stop_event.wait(CHANGE_STREAM_RETRY_SECONDS)
+
+        while not self._stop_event.is_set():
+            try:
+                self._poll()
+            except PyMongoError as e:
+                logger.error(f"Error polling changed users: {e}")
+                self._stop_event.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_user_cache_invalidator() -> UserCacheInvalidator:
+    invalidator = UserCacheInvalidator()
+    invalidator.start()
+    return invalidator
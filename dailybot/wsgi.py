@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import sys
+from http import HTTPStatus
+from typing import Callable, Iterable, List, Tuple
+
+from slack_bolt.request import BoltRequest
+
+from dailybot.jira_webhook import JIRA_WEBHOOK_PATH, JIRA_WEBHOOK_SECRET, handle_jira_webhook, is_authorized
+from dailybot.main import app
+from dailybot.metrics import format_metrics
+from dailybot.mongodb import get_daily_reports_database
+
+SLACK_EVENTS_PATH = "/slack/events"
+HEALTH_PATH = "/health"
+READY_PATH = "/ready"
+METRICS_PATH = "/metrics"  # the metrics of the worker process that answers
+
+logger = logging.getLogger(__name__)
+
+
+def _status_line(status: int) -> str:
+    return f"{status} {HTTPStatus(status).phrase}"
+
+
+def _read_body(environ: dict) -> str:
+    content_length = int(environ.get("CONTENT_LENGTH") or 0)
+    return environ["wsgi.input"].read(content_length).decode("utf-8") if content_length else ""
+
+
+def _request_headers(environ: dict) -> dict:
+    headers = {
+        key[len("HTTP_"):].replace("_", "-").lower(): value
+        for key, value in environ.items() if key.startswith("HTTP_")
+    }
+    if environ.get("CONTENT_TYPE"):
+        headers["content-type"] = environ["CONTENT_TYPE"]
+    return headers
+
+
+def _respond(start_response: Callable, status: int, body: str = "",
+             headers: List[Tuple[str, str]] = None) -> Iterable[bytes]:
+    start_response(_status_line(status), headers or [("Content-Type", "text/plain; charset=utf-8")])
+    return [body.encode("utf-8")]
+
+
+def is_ready() -> bool:
+    try:
+        get_daily_reports_database().client.admin.command("ping")
+        return True
+    except Exception as e:
+        logger.error(f"Readiness check failed: {e}")
+        return False
+
+
+def application(environ: dict, start_response: Callable) -> Iterable[bytes]:
+    path, method = environ.get("PATH_INFO", "/"), environ.get("REQUEST_METHOD", "GET")
+
+    if path == HEALTH_PATH:
+        return _respond(start_response, HTTPStatus.OK, "ok")
+    if path == READY_PATH:
+        ready = is_ready()
+        return _respond(start_response, HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE,
+                        "ready" if ready else "not ready")
+    if path == METRICS_PATH:
+        return _respond(start_response, HTTPStatus.OK, format_metrics())
+    if path == JIRA_WEBHOOK_PATH and method == "POST" and os.environ.get(JIRA_WEBHOOK_SECRET):
+        if not is_authorized(environ.get("QUERY_STRING", ""), os.environ.get(JIRA_WEBHOOK_SECRET)):
+            return _respond(start_response, HTTPStatus.UNAUTHORIZED)
+        try:
+            handle_jira_webhook(json.loads(_read_body(environ)))
+        except (ValueError, KeyError):
+            return _respond(start_response, HTTPStatus.BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error handling jira webhook: {e}")
+            return _respond(start_response, HTTPStatus.INTERNAL_SERVER_ERROR)
+        return _respond(start_response, HTTPStatus.NO_CONTENT)
+    if path != SLACK_EVENTS_PATH:
+        return _respond(start_response, HTTPStatus.NOT_FOUND)
+
+    bolt_response = app.dispatch(BoltRequest(
+        body=_read_body(environ),
+        query=environ.get("QUERY_STRING", ""),
+        headers=_request_headers(environ)
+    ))
+    headers = [(key, value) for key, values in bolt_response.headers.items() for value in values]
+    return _respond(start_response, bolt_response.status, bolt_response.body, headers)
+
+
+def run():
+    from gunicorn.app.wsgiapp import run as run_gunicorn
+
+    sys.argv = [sys.argv[0], "--config", "python:dailybot.gunicorn_conf", "dailybot.wsgi:application"]
+    run_gunicorn()
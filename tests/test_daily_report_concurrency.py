@@ -0,0 +1,67 @@
+import os
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dailybot.mongodb import (Daily, DailyIssueReport, DailyReport, get_collection, DAILIES_COLLECTION_NAME,
+                              MONGODB_URI)
+
+THREADS = 8
+WRITES_PER_THREAD = 20
+
+
+def make_report(user_id: str, write: int) -> DailyReport:
+    issue_report = DailyIssueReport(key=f"DAILY-{write}")
+    issue_report.details = f"{user_id} write {write}"
+    return DailyReport(issue_reports=[issue_report], general_comments=f"{user_id} write {write}")
+
+
+@unittest.skipUnless(os.environ.get(MONGODB_URI), f"needs a mongod, set {MONGODB_URI} to e.g. mongodb://localhost")
+class DailyReportConcurrencyTest(unittest.TestCase):
+    """Teammates submit to the same daily document at the same time, no write may overwrite another's report"""
+
+    def setUp(self):
+        self.team = f"concurrency-test-{uuid.uuid4().hex}"
+
+    def tearDown(self):
+        get_collection(DAILIES_COLLECTION_NAME).delete_many({"team": self.team})
+
+    def test_reports_of_different_users_survive(self):
+        def submit(user_id: str):
+            for write in range(WRITES_PER_THREAD):
+                self.assertTrue(Daily(team=self.team).save_report(user_id, make_report(user_id, write)))
+
+        user_ids = [f"U{i}" for i in range(THREADS)]
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(submit, user_ids))
+
+        daily = Daily.get_from_db(self.team)
+        self.assertEqual(set(daily.reports), set(user_ids))
+        for user_id, report in daily.reports.items():
+            self.assertEqual(report.version, WRITES_PER_THREAD)
+            self.assertEqual(report.general_comments, f"{user_id} write {WRITES_PER_THREAD - 1}")
+
+    def test_versioned_writes_of_the_same_user_are_not_lost(self):
+        user_id = "U0"
+
+        def submit(thread: int) -> int:
+            conflicts = 0
+            for write in range(WRITES_PER_THREAD):
+                while True:
+                    stored = Daily.get_from_db(self.team).reports.get(user_id)
+                    version = stored.version if stored else 0
+                    if Daily(team=self.team).save_report(user_id, make_report(user_id, write), version):
+                        break
+                    conflicts += 1
+            return conflicts
+
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(submit, range(THREADS)))
+
+        report = Daily.get_from_db(self.team).reports[user_id]
+        # every successful write incremented the version exactly once
+        self.assertEqual(report.version, THREADS * WRITES_PER_THREAD)
+
+
+if __name__ == '__main__':
+    unittest.main()
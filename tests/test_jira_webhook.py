@@ -0,0 +1,111 @@
+import json
+import os
+import unittest
+import uuid
+from http import HTTPStatus
+from threading import Thread
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from dailybot.jira_utils import transitions_cache
+from dailybot.jira_webhook import create_jira_webhook_server, JIRA_WEBHOOK_PATH, ISSUE_DELETED_EVENT
+from dailybot.mongodb import IssueSnapshot, get_collection, ISSUE_SNAPSHOTS_COLLECTION_NAME, MONGODB_URI
+
+SECRET = "webhook-sécret"
+JIRA_SERVER_URL = "https://webhook-test.atlassian.net"
+
+
+def make_issue(issue_key: str, status: str) -> dict:
+    return {
+        "key": issue_key,
+        "self": f"{JIRA_SERVER_URL}/rest/api/2/issue/{issue_key}",
+        "fields": {"summary": f"{issue_key} summary", "status": {"name": status}},
+    }
+
+
+class JiraWebhookServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = create_jira_webhook_server(0, SECRET)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, payload: dict, secret: str = None) -> int:
+        url = f"http://127.0.0.1:{self.server.server_address[1]}{JIRA_WEBHOOK_PATH}"
+        if secret is not None:
+            url += f"?secret={quote(secret)}"
+        request = Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+        try:
+            with urlopen(request, timeout=5) as response:
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+
+class JiraWebhookAuthorizationTest(JiraWebhookServerTest):
+    """Events without the secret must not touch the caches or the snapshots"""
+
+    def test_unauthorized_events_are_rejected(self):
+        transitions_cache.set((JIRA_SERVER_URL, "email", "token", "cloud", "AUTH-1"), [{"id": "1"}])
+        for secret in (None, "", "wrong", "webhook-secret"):
+            for event in ("jira:issue_updated", ISSUE_DELETED_EVENT):
+                with self.subTest(secret=secret, event=event):
+                    status = self.post({"webhookEvent": event, "issue": make_issue("AUTH-1", "Done")}, secret)
+                    self.assertEqual(status, HTTPStatus.UNAUTHORIZED)
+        self.assertIsNotNone(transitions_cache.get((JIRA_SERVER_URL, "email", "token", "cloud", "AUTH-1")))
+
+    def test_non_ascii_secret_is_accepted(self):
+        # an event without an issue is acknowledged without touching the snapshots
+        self.assertEqual(self.post({"webhookEvent": "jira:issue_updated"}, SECRET), HTTPStatus.NO_CONTENT)
+
+
+@unittest.skipUnless(os.environ.get(MONGODB_URI), f"needs a mongod, set {MONGODB_URI} to e.g. mongodb://localhost")
+class JiraWebhookEventsTest(JiraWebhookServerTest):
+    """Authorized events update the snapshots and drop the cached transitions of the issue"""
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = f"webhook-test-{uuid.uuid4().hex}"
+        self.issue_key = "HOOK-1"
+        self.cache_key = (JIRA_SERVER_URL, "email", "token", "cloud", self.issue_key)
+        issue = make_issue(self.issue_key, "To Do")
+        issue["transitions"] = [{"id": "1"}]
+        IssueSnapshot(user_id=self.user_id, issues={self.issue_key: issue},
+                      jira_host="webhook-test.atlassian.net").save_in_db()
+        transitions_cache.set(self.cache_key, [{"id": "1"}])
+
+    def tearDown(self):
+        get_collection(ISSUE_SNAPSHOTS_COLLECTION_NAME).delete_one({"_id": self.user_id})
+        super().tearDown()
+
+    def test_issue_updated(self):
+        status = self.post({"webhookEvent": "jira:issue_updated", "issue": make_issue(self.issue_key, "Done")}, SECRET)
+        self.assertEqual(status, HTTPStatus.NO_CONTENT)
+
+        issue = IssueSnapshot.get_from_db(self.user_id).issues[self.issue_key]
+        self.assertEqual(issue["fields"]["status"], {"name": "Done"})
+        self.assertNotIn("transitions", issue)
+        self.assertIsNone(transitions_cache.get(self.cache_key))
+
+    def test_issue_deleted(self):
+        status = self.post({"webhookEvent": ISSUE_DELETED_EVENT, "issue": make_issue(self.issue_key, "To Do")}, SECRET)
+        self.assertEqual(status, HTTPStatus.NO_CONTENT)
+
+        self.assertNotIn(self.issue_key, IssueSnapshot.get_from_db(self.user_id).issues)
+        self.assertIsNone(transitions_cache.get(self.cache_key))
+
+    def test_events_of_another_jira_server_are_ignored(self):
+        issue = make_issue(self.issue_key, "Done")
+        issue["self"] = f"https://other.atlassian.net/rest/api/2/issue/{self.issue_key}"
+        self.assertEqual(self.post({"webhookEvent": ISSUE_DELETED_EVENT, "issue": issue}, SECRET),
+                         HTTPStatus.NO_CONTENT)
+
+        self.assertIn(self.issue_key, IssueSnapshot.get_from_db(self.user_id).issues)
+        self.assertIsNotNone(transitions_cache.get(self.cache_key))
+
+
+if __name__ == '__main__':
+    unittest.main()